@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name,no-member
+
+"""Run kops modules inside Ansible controller (base class of kops action plugins)"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+import sys
+import traceback
+from importlib.util import module_from_spec, spec_from_file_location
+
+import ansible.module_utils
+
+from ansible import constants as C
+from ansible.module_utils import basic
+from ansible.module_utils.json_utils import _filter_non_json_lines
+from ansible.module_utils.six import StringIO
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.plugins.action import ActionBase
+from ansible.vars.clean import remove_internal_keys
+
+# Serialization profile of module parameters and results (Ansible >= 2.19)
+SERIALIZATION_PROFILE = 'legacy'
+
+# Modules already imported by this worker (loops run every item in the same worker)
+_loaded_modules = {}
+
+
+def load_module(module_path):
+    """Import kops module file without running it"""
+    name = 'ansible_kops_' + os.path.splitext(os.path.basename(module_path))[0]
+    if module_path not in _loaded_modules:
+        spec = spec_from_file_location(name, module_path)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded_modules[module_path] = module
+    return _loaded_modules[module_path]
+
+
+def add_module_utils_path():
+    """
+        Let modules run in process import kops module utils: configured module
+        utils paths, then module_utils directory of this repository
+    """
+    paths = list(C.DEFAULT_MODULE_UTILS_PATH or []) + [
+        os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'module_utils')
+    ]
+    for path in paths:
+        if os.path.isdir(path) and path not in ansible.module_utils.__path__:
+            ansible.module_utils.__path__.append(path)
+
+
+def get_cache_dir():
+    """Read cache shared by every task of the run (removed with Ansible local tmp)"""
+    return os.path.join(C.DEFAULT_LOCAL_TMP, 'kops-cache')
+
+
+class KopsActionModule(ActionBase):
+    """
+        Run kops module in the worker process of the task instead of sending it
+        through AnsiballZ to a new interpreter (local connection only)
+    """
+
+    _supports_check_mode = True
+
+    def _is_in_process(self, module_args):
+        """Modules are only run in process for localhost"""
+        if getattr(self._connection, 'transport', None) != 'local':
+            return False
+        # Profiler statistics are written when module process exits
+        return module_args.get('profile_file') is None
+
+
+    def _get_module_path(self):
+        """Path of the module file (library directory next to action plugins by default)"""
+        module_path = self._shared_loader_obj.module_loader.find_plugin(self._task.action, '.py')
+        if module_path is None:
+            module_path = os.path.join(
+                os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                'library', self._task.action + '.py'
+            )
+        return module_path
+
+
+    def _parse_output(self, output):
+        """Send back module result from its standard output"""
+        res = dict(rc=0, stdout=output, stderr='')
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            return self._parse_returned_data(res, SERIALIZATION_PROFILE)
+        # pylint: disable=no-value-for-parameter
+        try:
+            return json.loads(_filter_non_json_lines(output)[0])
+        except ValueError:
+            return dict(failed=True, msg="MODULE FAILURE", module_stdout=output)
+
+
+    @staticmethod
+    def _can_check_freshness(module_args, environment):
+        """
+            Check if cached reads of every state store used by the task can be checked
+            against the state store (file:// and s3:// with boto3)
+        """
+        # pylint: disable=import-error
+        from ansible.module_utils.kops_state_store import get_state_store_reader
+
+        default_state_store = (
+            module_args.get('state_store') or environment.get('KOPS_STATE_STORE')
+            or os.environ.get('KOPS_STATE_STORE', '')
+        )
+        state_stores = [default_state_store] + [
+            cluster.get('state_store') or default_state_store
+            for cluster in module_args.get('clusters') or [] if isinstance(cluster, dict)
+        ]
+        return all(
+            get_state_store_reader(state_store, module_args.get('state_store_endpoint')) is not None
+            for state_store in state_stores
+        )
+
+
+    def _run_in_process(self, module_args, task_vars):
+        """Import module and call its main() with module_args"""
+        module_args = dict(module_args)
+        self._update_module_args(self._task.action, module_args, task_vars)
+        environment = {}
+        self._compute_environment_string(environment)
+
+        add_module_utils_path()
+        # Without freshness check, cached reads could miss changes made outside of these modules.
+        # Every read is cached as kops output (fully populated specification included)
+        if 'cache_dir' not in module_args and self._can_check_freshness(module_args, environment):
+            module_args['cache_dir'] = get_cache_dir()
+        module = load_module(self._get_module_path())
+        basic._ANSIBLE_ARGS = to_bytes(json.dumps({'ANSIBLE_MODULE_ARGS': module_args}))
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            basic._ANSIBLE_PROFILE = SERIALIZATION_PROFILE
+
+        saved_environ = dict(os.environ)
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            os.environ.update(environment)
+            try:
+                module.main()
+            except SystemExit:
+                pass
+            # Report module errors as failed results like AnsiballZ instead of plugin tracebacks
+            except Exception as e:  # pylint: disable=broad-except
+                return dict(failed=True, msg=to_native(e), exception=traceback.format_exc())
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved_stdout
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            basic._ANSIBLE_ARGS = None
+        return self._parse_output(output)
+
+
+    def run(self, tmp=None, task_vars=None):
+        """Run kops module in process or send it to the target"""
+        if task_vars is None:
+            task_vars = dict()
+        result = super(KopsActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        if self._is_in_process(self._task.args):
+            module_result = self._run_in_process(self._task.args, task_vars)
+            remove_internal_keys(module_result)
+            result.update(module_result)
+        else:
+            result.update(self._execute_module(task_vars=task_vars))
+        return result
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name,wrong-import-position
+
+"""Run kops_cluster module inside Ansible controller"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+
+# Base class is stored next to action plugins
+ACTION_PLUGINS_PATH = os.path.dirname(os.path.realpath(__file__))
+if ACTION_PLUGINS_PATH not in sys.path:
+    sys.path.insert(0, ACTION_PLUGINS_PATH)
+
+from kops_action_base import KopsActionModule
+
+
+class ActionModule(KopsActionModule):
+    """kops_cluster action"""
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Compare time spent parsing and serializing kops objects as YAML and JSON
+
+A large cluster (fully populated like specification and many instance
+groups) is generated, then parsed and serialized with functions used by
+Kops modules.
+"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import yaml
+
+path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(path, '../module_utils'))
+
+# pylint: disable=wrong-import-position
+from kops_serialization import dump_json, dump_yaml, load_json_documents, load_yaml_documents
+
+
+def generate_objects(instance_groups):
+    cluster_name = 'benchmark.example.org'
+    zones = ['eu-west-1a', 'eu-west-1b', 'eu-west-1c']
+    cluster = {
+        'apiVersion': 'kops/v1alpha2',
+        'kind': 'Cluster',
+        'metadata': {'name': cluster_name, 'creationTimestamp': '2018-12-03T10:42:44Z'},
+        'spec': {
+            'kubernetesVersion': '1.11.6',
+            'kubernetesApiAccess': ['10.%d.0.0/16' % i for i in range(50)],
+            'sshAccess': ['10.%d.0.0/16' % i for i in range(50)],
+            'etcdClusters': [
+                {
+                    'name': name,
+                    'etcdMembers': [
+                        {'instanceGroup': 'master-' + zone, 'name': zone[-1]} for zone in zones
+                    ],
+                } for name in ['main', 'events']
+            ],
+            'subnets': [
+                {'cidr': '172.20.%d.0/19' % (32 * i), 'name': zone, 'type': 'Public', 'zone': zone}
+                for i, zone in enumerate(zones)
+            ],
+            'additionalPolicies': {
+                'node': json.dumps([{'Effect': 'Allow', 'Action': ['s3:*'], 'Resource': ['*']}] * 20),
+                'master': json.dumps([{'Effect': 'Allow', 'Action': ['ec2:*'], 'Resource': ['*']}] * 20),
+            },
+            'addons': [{'manifest': 's3://addons/addon-%d/addon.yaml' % i} for i in range(200)],
+            'kubelet': dict(('option%d' % i, 'value%d' % i) for i in range(200)),
+        },
+    }
+    instance_groups_definitions = [
+        {
+            'apiVersion': 'kops/v1alpha2',
+            'kind': 'InstanceGroup',
+            'metadata': {
+                'name': 'nodes-%d' % i,
+                'creationTimestamp': '2018-12-03T10:42:44Z',
+                'labels': {'kops.k8s.io/cluster': cluster_name},
+            },
+            'spec': {
+                'image': 'kope.io/k8s-1.11-debian-stretch-amd64-hvm-ebs-2018-08-17',
+                'machineType': 't2.medium',
+                'maxSize': 5,
+                'minSize': 2,
+                'role': 'Node',
+                'rootVolumeSize': 100,
+                'subnets': zones,
+                'nodeLabels': dict(('label%d' % j, 'value%d' % j) for j in range(20)),
+                'cloudLabels': dict(('tag%d' % j, 'value%d' % j) for j in range(20)),
+            },
+        } for i in range(instance_groups)
+    ]
+    return [cluster] + instance_groups_definitions
+
+
+def benchmark(name, function, number):
+    duration = min(timeit.repeat(function, number=number, repeat=3)) / number
+    print("%-40s %10.2f ms" % (name, duration * 1000))
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--instance-groups', type=int, default=300)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    objects = generate_objects(args.instance_groups)
+    yaml_output = '---\n'.join(dump_yaml(o) for o in objects)
+    json_output = '\n'.join(json.dumps(o, indent=2) for o in objects)
+    print("%d objects, yaml: %d KB, json: %d KB, libyaml: %s" % (
+        len(objects), len(yaml_output) // 1024, len(json_output) // 1024, yaml.__with_libyaml__
+    ))
+
+    pure_yaml = benchmark(
+        "parse yaml (pure python loader)",
+        lambda: [o for o in yaml.load_all(yaml_output, Loader=yaml.SafeLoader) if o],
+        args.number
+    )
+    c_yaml = benchmark(
+        "parse yaml (load_yaml_documents)", lambda: list(load_yaml_documents(yaml_output)), args.number
+    )
+    c_json = benchmark(
+        "parse json (load_json_documents)", lambda: list(load_json_documents(json_output)), args.number
+    )
+    benchmark("dump yaml (dump_yaml)", lambda: [dump_yaml(o) for o in objects], args.number)
+    benchmark("dump json (dump_json)", lambda: [dump_json(o) for o in objects], args.number)
+
+    print("json parsing is %.1fx faster than yaml (%.1fx faster than pure python yaml)" % (
+        c_yaml / c_json, pure_yaml / c_json
+    ))
+
+
+if __name__ == '__main__':
+    main()
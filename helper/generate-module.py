@@ -4,14 +4,20 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
-import os,re
-from jinja2 import Environment, FileSystemLoader
+import argparse,hashlib,json,os,re,shutil,subprocess,sys
+from multiprocessing.pool import ThreadPool
 
 path = os.path.dirname(os.path.abspath(__file__))
 modules_path = os.path.join(path, '../templates')
 modules_output = os.path.join(path, '../library')
 
-env = Environment(loader = FileSystemLoader(modules_path))
+modules = ['kops_cluster.py', 'kops_facts.py', 'kops_fleet.py', 'kops_ig.py']
+
+help_commands = [
+    ('cluster_options', ['create', 'cluster', '--help'], 'create'),
+    ('rolling_update_options', ['rolling-update', 'cluster', '--help'], 'rolling-update'),
+    ('ig_options', ['create', 'ig', '--help'], 'create-ig'),
+]
 
 option_to_ignore = ["yes", "help", "interactive", "output", "edit"]
 
@@ -23,8 +29,8 @@ def get_ansible_type(option_type):
     return 'str'
 
 
-def load_help(cmd, tag):
-    output = os.popen(cmd).read().split("\n")
+def parse_help(output, tag):
+    output = output.split("\n")
     while len(output) > 0:
         current_line = output.pop(0)
         if current_line == 'Flags:':
@@ -67,19 +73,136 @@ def load_help(cmd, tag):
 
     return kops_options
 
-cluster_options = load_help("kops create cluster --help", "create")
-rolling_update_options = load_help("kops rolling-update cluster --help", "rolling-update")
-ig_options = load_help("kops create ig --help", "create-ig")
-
-for module in ['kops_cluster.py', 'kops_facts.py', 'kops_ig.py']:
-    module_template = env.get_template(module)
-
-    with open(modules_output + '/' + module, 'w') as f:
-        rendered_module = module_template.render(
-            dict(
-                cluster_options=cluster_options,
-                rolling_update_options=rolling_update_options,
-                ig_options=ig_options
-            )
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_json(file_path):
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(file_path, content):
+    # Keys are not sorted: templates render options in kops order
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f, indent=2)
+    os.rename(tmp_path, file_path)
+
+
+def run_kops(kops_cmd, options):
+    return subprocess.check_output([kops_cmd] + options).decode('utf-8')
+
+
+def get_kops_hash(kops_cmd, cache_dir):
+    """sha256 of kops binary, only computed again when binary size or mtime change"""
+    stat = os.stat(kops_cmd)
+    index_path = os.path.join(cache_dir, 'binaries.json')
+    index = read_json(index_path) or {}
+    entry = index.get(kops_cmd)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return entry['sha256']
+    index[kops_cmd] = dict(size=stat.st_size, mtime=stat.st_mtime, sha256=file_hash(kops_cmd))
+    write_json(index_path, index)
+    return index[kops_cmd]['sha256']
+
+
+def load_schema(kops_cmd, cache_dir):
+    """
+        Options of kops commands used by templates
+        Schema is kept in cache_dir and keyed by kops binary hash and version:
+        kops is only launched when the binary changes.
+    """
+    kops_hash = get_kops_hash(kops_cmd, cache_dir)
+    schema_path = os.path.join(cache_dir, 'schema-%s.json' % kops_hash)
+    schema = read_json(schema_path)
+    if schema is not None:
+        return schema
+
+    pool = ThreadPool(len(help_commands) + 1)
+    try:
+        outputs = pool.map(
+            lambda options: run_kops(kops_cmd, options),
+            [['version']] + [options for (_, options, _) in help_commands]
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    schema = dict(kops_sha256=kops_hash, kops_version=outputs[0].strip())
+    for ((name, _, tag), output) in zip(help_commands, outputs[1:]):
+        schema[name] = parse_help(output, tag)
+    write_json(schema_path, schema)
+    return schema
+
+
+def get_render_key(module, schema):
+    """Modules only change with their template, kops options or this script"""
+    digest = hashlib.sha256()
+    for file_path in [os.path.join(modules_path, module), os.path.abspath(__file__)]:
+        digest.update(file_hash(file_path).encode('utf-8'))
+    for (name, _, _) in help_commands:
+        digest.update(json.dumps(schema[name]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_modules(schema, cache_dir, force=False):
+    """Render templates whose inputs changed (or whose module was modified)"""
+    rendered_path = os.path.join(cache_dir, 'rendered.json')
+    rendered = read_json(rendered_path) or {}
+    env = None
+    for module in modules:
+        module_path = os.path.join(modules_output, module)
+        render_key = get_render_key(module, schema)
+        previous = rendered.get(module_path, {})
+        if (not force and previous.get('key') == render_key and os.path.exists(module_path)
+                and previous.get('sha256') == file_hash(module_path)):
+            continue
+
+        if env is None:
+            from jinja2 import Environment, FileSystemLoader
+            env = Environment(loader = FileSystemLoader(modules_path))
+        rendered_module = env.get_template(module).render(
+            dict((name, schema[name]) for (name, _, _) in help_commands)
         )
-        f.write(rendered_module)
+        with open(module_path, 'w') as f:
+            f.write(rendered_module)
+        rendered[module_path] = dict(key=render_key, sha256=file_hash(module_path))
+        print("%s rendered" % module)
+    write_json(rendered_path, rendered)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render kops modules from templates and kops options')
+    parser.add_argument('--kops', default=os.environ.get('KOPS_CMD', 'kops'),
+                        help='kops binary used to read options (default: kops)')
+    parser.add_argument('--cache-dir', default=os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'kops-ansible', 'generate-module'
+    ), help='Directory keeping kops options and rendered modules state')
+    parser.add_argument('--force', action='store_true',
+                        help='Read kops options and render every module again')
+    args = parser.parse_args()
+
+    kops_cmd = shutil.which(args.kops)
+    if kops_cmd is None:
+        sys.exit("kops binary not found: %s" % args.kops)
+    kops_cmd = os.path.realpath(kops_cmd)
+    if not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    if args.force:
+        schema_path = os.path.join(args.cache_dir, 'schema-%s.json' % get_kops_hash(kops_cmd, args.cache_dir))
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+    render_modules(load_schema(kops_cmd, args.cache_dir), args.cache_dir, args.force)
+
+
+if __name__ == '__main__':
+    main()
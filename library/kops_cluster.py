@@ -10,7 +10,7 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
-from ansible.module_utils.kops import Kops, to_camel_case
+from ansible.module_utils.kops_cluster_handler import KopsClusterHandler
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
                     'status': ['preview'],
@@ -42,6 +42,150 @@ options:
      type: string
      required: false
      default: None
+  cache_dir:
+     description:
+       - Directory used to keep kops reads between runs. Cache is disabled if not set.
+       - Entries are keyed by state store, cluster name and kops version and dropped on every change made by modules.
+     type: path
+     required: false
+     default: None
+  cache_ttl:
+     description:
+       - Number of seconds a cached kops read is considered valid.
+       - Entries are also dropped as soon as state store objects change (mtime with file:// state store, ETag with s3:// state store when boto3 is available).
+     type: int
+     required: false
+     default: 300
+  direct_read:
+     description:
+       - Read cluster and instance group definitions straight from the state store instead of launching kops.
+       - Supported with file:// and s3:// (boto3 required) state stores. kops is used for other state stores, for fully populated specifications and when state store can't be read.
+     type: bool
+     required: false
+     default: false
+  state_store_endpoint:
+     description:
+       - Endpoint of a S3 compatible state store used by direct reads (default to S3_ENDPOINT environment variable).
+     type: string
+     required: false
+     default: None
+  wire_format:
+     description:
+       - Format used to read and write kops objects.
+       - C(auto) uses json when kops supports it (kops >= 1.8) and yaml otherwise. Fully populated specifications are always read as yaml.
+     type: string
+     required: false
+     default: auto
+     choices: [ auto, json, yaml ]
+  trace_file:
+     description:
+       - File where a JSON line is appended for each kops process launched (same records as I(kops_trace)).
+     type: path
+     required: false
+     default: None
+  profile_file:
+     description:
+       - Profile Python side of the module with cProfile and dump statistics to this file when module exits (read them with pstats).
+       - Only the main thread is profiled.
+     type: path
+     required: false
+     default: None
+  read_timeout:
+     description:
+       - Seconds given to a kops read (eg: C(kops get)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 600
+  write_timeout:
+     description:
+       - Seconds given to a kops write (eg: C(kops replace), C(kops update cluster)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 1800
+  rolling_update_timeout:
+     description:
+       - Seconds given to a kops rolling update before its process group is stopped and the module fails. No timeout by default.
+       - Not applied to rolling updates started with I(rolling_update_progress_file).
+     type: int
+     required: false
+     default: None
+  task_timeout:
+     description:
+       - Seconds given to every kops command launched by the task. Commands are stopped once this deadline is reached.
+       - On timeout, commands already completed are sent back in I(completed_commands).
+     type: int
+     required: false
+     default: None
+  retries:
+     description:
+       - Number of times a failed kops command is launched again when its error is transient (eg: S3 C(SlowDown), API throttling, C(RequestLimitExceeded)).
+       - Only reads, C(kops replace), C(kops update cluster) and rolling update probes are retried. Other errors fail at once.
+     type: int
+     required: false
+     default: 3
+  retry_delay:
+     description:
+       - Base delay (seconds) between retries, doubled on each retry with random jitter (at most 60 seconds).
+     type: float
+     required: false
+     default: 1
+  rate_limit:
+     description:
+       - Maximum number of kops processes started per second against the state store (or I(rate_limit_key)), shared by every task and playbook of this host.
+       - Tokens are taken from a token bucket stored in I(rate_limit_dir) and locked with flock. No limit by default.
+     type: float
+     required: false
+     default: None
+  rate_limit_burst:
+     description:
+       - Number of kops processes which can be started at once before I(rate_limit) applies.
+     type: int
+     required: false
+     default: 5
+  rate_limit_key:
+     description:
+       - Name of the shared limit (eg: cloud account id) when several state stores use the same account. State store by default.
+     type: str
+     required: false
+     default: None
+  rate_limit_dir:
+     description:
+       - Directory of token buckets. C(kops-ansible-rate-limit) in temporary directory by default.
+     type: path
+     required: false
+     default: None
+  rolling_update_concurrency:
+     description:
+       - Roll instance groups needing update with one kops process each instead of one kops rolling update of the whole cluster.
+       - Masters are rolled first, one at a time, then at most I(rolling_update_concurrency) node groups are rolled at the same time.
+       - First failure stops every running rolling update. Duration of each instance group is sent back in I(rolling_update).
+     type: int
+     required: false
+     default: None
+  journal_dir:
+     description:
+       - Directory of a local journal recording a fingerprint of cluster and instance groups specifications (and kops version) once they are successfully applied.
+       - When specifications still match the journal, C(kops update cluster) and rolling update probe are skipped.
+       - Changes made outside of these modules are not detected, use I(force_apply) to check the cloud again.
+     type: path
+     required: false
+     default: None
+  force_apply:
+     description:
+       - Check and apply cloud changes even if the journal reports specifications as already applied.
+       - Without it, C(kops update cluster) is only run when the task changes cluster or instance groups specifications.
+     type: bool
+     required: false
+     default: false
+  rolling_update_progress_file:
+     description:
+       - Start rolling update in a detached process instead of waiting for it. kops output is written to this file.
+       - Module returns as soon as rolling update is started, progress is read with M(kops_facts) I(rolling_update_progress) option.
+       - Can't be used with I(rolling_update_concurrency).
+       - Module fails when a rolling update recorded in this file is still running.
+     type: path
+     required: false
+     default: None
   state:
      description:
        - If C(present), cluster will be created
@@ -365,6 +509,7 @@ options:
      default: '4m0s'
 notes:
    - kops bin is required
+   - boto3 is required to read s3:// state store without kops
 author:
    - Yannig Perré
 '''
@@ -378,21 +523,83 @@ EXAMPLES = '''
 
 RETURN = '''
 ---
+spec_changes:
+   description: Spec paths really changed by the module (eg: spec.kubernetesVersion), keyed by cluster or instance group name
+   returned: always
+   type: dict
+change_impacts:
+   description:
+     - Impacts of spec changes made by the module (C(update-only), C(roll-masters), C(roll-nodes)), null when unknown or nothing changed
+     - With C(update-only) changes (eg: I(min_size), I(max_size), I(admin_access)), rolling update is not probed. With C(roll-masters) or C(roll-nodes) only, rolling update is limited to these instance groups.
+   returned: when changes are applied
+   type: list
+spec_fingerprint:
+   description: Hash of cluster and instance groups specifications recorded in journal
+   returned: when I(journal_dir) is set and changes are applied
+   type: str
+spec_already_applied:
+   description: True when update and rolling update were skipped as journal reports specifications as applied
+   returned: when I(journal_dir) is set and changes are applied
+   type: bool
+rolling_update:
+   description: Result of each instance group (name, status, duration in seconds) when I(rolling_update_concurrency) is set
+   returned: when instance groups are rolled
+   type: dict
+rolling_update_timings:
+   description:
+     - Time spent (in seconds) on each node (drain, terminate and validation) and instance group (duration), parsed from kops output
+     - Unknown values (step skipped by kops) are null
+   returned: when instance groups are rolled
+   type: dict
+rolling_update_progress:
+   description: Detached rolling update (status, pid and progress_file) when I(rolling_update_progress_file) is set
+   returned: when rolling update is started
+   type: dict
+planned_commands:
+   description: kops commands (without kops binary and state store) which would have been launched to apply changes
+   returned: check mode
+   type: list
+timed_out:
+   description: True when a kops command has been stopped by I(read_timeout), I(write_timeout), I(rolling_update_timeout) or I(task_timeout)
+   returned: on timeout
+   type: bool
+completed_commands:
+   description: kops commands (without kops binary) completed before the timeout
+   returned: on timeout
+   type: list
+kops_trace:
+   description: One record per kops process launched with argv (secret values masked), start, duration (seconds), rc, stdout_bytes, stderr_bytes and caller (eg: get_nodes)
+   returned: always
+   type: list
+kops_invocations:
+   description: Number of kops processes launched by the module
+   returned: always
+   type: int
+kops_cached_reads:
+   description: Number of kops reads answered from cache instead of launching kops
+   returned: always
+   type: int
+state_store_reads:
+   description: Number of reads made straight from the state store instead of launching kops
+   returned: always
+   type: int
+kops_retries:
+   description: Number of kops commands launched again after a transient error
+   returned: always
+   type: int
+kops_retry_time:
+   description: Seconds spent waiting between retries
+   returned: always
+   type: float
+kops_rate_limit_wait:
+   description: Seconds spent waiting for the rate limiter before launching kops
+   returned: always
+   type: float
 '''
 
-class KopsCluster(Kops):
+class KopsCluster(KopsClusterHandler):
     """Handle state for kops cluster"""
 
-    SPECIAL_CASE = {
-        "admin_access": {
-            "field": "kubernetesApiAccess",
-            "transform": "list"
-        },
-        "ssh_access": {
-            "transform": "list"
-        }
-    }
-
     def __init__(self):
         """Init module parameters"""
         additional_module_args = dict(
@@ -400,6 +607,10 @@ class KopsCluster(Kops):
             cloud=dict(choices=['gce', 'aws', 'vsphere'], default='aws'),
             docker=dict(type=dict),
             additional_policies=dict(type=dict, aliases=['additional-policies', 'additionalPolicies']),
+            rolling_update_concurrency=dict(type=int),
+            rolling_update_progress_file=dict(type='path'),
+            journal_dir=dict(type='path'),
+            force_apply=dict(type=bool, default=False),
             admin_access=dict(type=str, aliases=['admin-access']),
             api_loadbalancer_type=dict(type=str, aliases=['api-loadbalancer-type']),
             api_ssl_certificate=dict(type=str, aliases=['api-ssl-certificate']),
@@ -504,136 +715,19 @@ class KopsCluster(Kops):
             'master_interval': {'name': 'master_interval', 'alias': 'master-interval', 'type': 'str', 'help': 'Time to wait between restarting masters', 'default': "'5m0s'", 'tag': 'rolling-update'},
             'node_interval': {'name': 'node_interval', 'alias': 'node-interval', 'type': 'str', 'help': 'Time to wait between restarting nodes', 'default': "'4m0s'", 'tag': 'rolling-update'},
         }
-        super(KopsCluster, self).__init__(additional_module_args, options_definition)
-
-
-    def delete_cluster(self, cluster_name):
-        """Delete cluster"""
-        (result, out, err) = self.run_command(
-            ["delete", "cluster", "--yes", "--name", cluster_name]
-        )
-        if result > 0:
-            self.module.fail_json(msg=err)
-        return dict(
-            changed=True,
-            kops_output=out,
-            cluster_name=cluster_name,
-        )
-
-
-    def create_cluster(self, cluster_name):
-        """Create cluster using kops"""
-        cmd = ["create", "cluster", "--name", cluster_name]
-
-        if self.module.params['state'] in ['updated', 'started']:
-            cmd.append("--yes")
-
-        (result, out, err) = self.run_command(cmd, add_optional_args_from_tag="create")
-        if result > 0:
-            self.module.fail_json(msg=err)
-
-        # Handle docker definition (version, options)
-        self.update_cluster(cluster_name)
-
-        return dict(
-            changed=True,
-            cluster_name=cluster_name,
-            kops_output=out
-        )
-
-
-    def get_spec_name(self, param):
-        """
-          Send back variable name as expected in spec field from param name
-          Handle corner case like Cidr/CIDR or special case
-        """
-        if param in self.SPECIAL_CASE and self.SPECIAL_CASE[param].get('field'):
-            return self.SPECIAL_CASE[param]['field']
-
-        return to_camel_case(param).replace('Cidr', 'CIDR')
-
-    def convert_value(self, param, value):
-        """Do some transformation from string to list using SPECIAL_CASE values"""
-        if param in self.SPECIAL_CASE:
-            if self.SPECIAL_CASE[param]['transform'] == 'list':
-                return [x.strip() for x in value.split(",")]
-        # If not a special case, send unchanged value
-        return value
-
-    def update_cluster(self, cluster_name):
-        """Update cluster"""
-        cluster_definition = self.get_clusters(cluster_name)
-
-        spec_to_merge = {}
-        cluster_parameters = [
-            'kubernetes_version', 'master_public_name', 'network_cidr',
-            'admin_access', 'ssh_access', 'docker', 'additional_policies',
-        ]
-        for param in cluster_parameters:
-            spec_name = self.get_spec_name(param)
-            value = self.module.params[param]
-            if spec_name in cluster_definition['spec']:
-                current_value = cluster_definition['spec'][spec_name]
-            else:
-                current_value = None
-
-            if value is not None and value != current_value:
-                spec_to_merge[spec_name] = value
-
-        return self.update_object_definition(cluster_name, cluster_definition, spec_to_merge)
-
-
-    def apply_present(self, cluster_name, defined_cluster):
-        """Create cluster if does not exist"""
-        if defined_cluster:
-            changed = self.update_cluster(cluster_name)
-            if self.module.params['state'] in ['updated', 'started']:
-                return self._apply_modifications(cluster_name)
-            if changed:
-                defined_cluster = self.get_clusters(cluster_name)
-            return dict(
-                changed=changed,
-                cluster_name=cluster_name,
-                defined_cluster=defined_cluster
-            )
-        return self.create_cluster(cluster_name)
-
-
-    def apply_absent(self, cluster_name, cluster_exist):
-        """Delete cluster if cluster exist"""
-        if not cluster_exist:
-            return dict(
-                changed=False,
-                cluster_name=cluster_name,
-            )
-        return self.delete_cluster(cluster_name)
-
-
-    def check_cluster_state(self):
-        """Check cluster state and apply expected state"""
-        cluster_name = self.module.params['name']
-        state = self.module.params['state']
-        defined_cluster = self.get_clusters(
-            cluster_name=cluster_name,
-            retrieve_ig=False,
-            failed_when_not_found=False
+        super(KopsCluster, self).__init__(
+            additional_module_args,
+            options_definition,
+            mutually_exclusive=[['rolling_update_concurrency', 'rolling_update_progress_file']],
+            supports_check_mode=True
         )
 
-        if state in ['present', 'updated']:
-            return self.apply_present(cluster_name, defined_cluster)
-
-        if state == 'absent':
-            return self.apply_absent(cluster_name, defined_cluster)
-
-        self.module.fail_json(msg="Operation not supported", defined_cluster=defined_cluster)
-        return None
-
 
     def exit_json(self):
         """Send back result to Ansible"""
         results = self.check_cluster_state()
 
-        self.module.exit_json(**results)
+        self.module_exit_json(spec_changes=self.spec_changes, **results)
 
 
 def main():
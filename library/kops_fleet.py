@@ -0,0 +1,497 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name,dangerous-default-value,duplicate-code
+
+"""Handle state of several kops clusters at once"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import time
+
+from ansible.module_utils.kops import Kops, KopsError, KopsModuleView
+from ansible.module_utils.kops_cluster_handler import KopsClusterHandler
+from ansible.module_utils.six import iteritems
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: kops_fleet
+short_description: Handle several clusters with kops
+description:
+     - Let you create, update or delete a list of clusters using kops
+     - Clusters are handled concurrently, steps of one cluster (update, rolling update) are run in order
+version_added: "2.8"
+options:
+  clusters:
+     description:
+       - List of clusters definitions.
+       - Each item accepts I(name) (required), I(state) (C(present), C(updated) or C(absent), default to C(present)), I(cloud), I(docker), I(additional_policies) and every cluster creation and rolling update options of M(kops_cluster).
+       - A cluster must be listed only once.
+     type: list
+     required: true
+  workers:
+     description:
+       - Number of clusters handled at the same time
+     type: int
+     required: false
+     default: 4
+  state_store:
+     description:
+       - State store (eg: s3://my-state-store)
+     type: string
+     required: false
+     default: None
+  kops_cmd:
+     description:
+       - kops bin path
+     type: string
+     required: false
+     default: None
+  cache_dir:
+     description:
+       - Directory used to keep kops reads between runs. Cache is disabled if not set.
+       - Entries are keyed by state store, cluster name and kops version and dropped on every change made by modules.
+     type: path
+     required: false
+     default: None
+  cache_ttl:
+     description:
+       - Number of seconds a cached kops read is considered valid.
+       - Entries are also dropped as soon as state store objects change (mtime with file:// state store, ETag with s3:// state store when boto3 is available).
+     type: int
+     required: false
+     default: 300
+  direct_read:
+     description:
+       - Read cluster and instance group definitions straight from the state store instead of launching kops.
+       - Supported with file:// and s3:// (boto3 required) state stores. kops is used for other state stores, for fully populated specifications and when state store can't be read.
+     type: bool
+     required: false
+     default: false
+  state_store_endpoint:
+     description:
+       - Endpoint of a S3 compatible state store used by direct reads (default to S3_ENDPOINT environment variable).
+     type: string
+     required: false
+     default: None
+  wire_format:
+     description:
+       - Format used to read and write kops objects.
+       - C(auto) uses json when kops supports it (kops >= 1.8) and yaml otherwise. Fully populated specifications are always read as yaml.
+     type: string
+     required: false
+     default: auto
+     choices: [ auto, json, yaml ]
+  trace_file:
+     description:
+       - File where a JSON line is appended for each kops process launched (same records as I(kops_trace)).
+     type: path
+     required: false
+     default: None
+  profile_file:
+     description:
+       - Profile Python side of the module with cProfile and dump statistics to this file when module exits (read them with pstats).
+       - Only the main thread is profiled.
+     type: path
+     required: false
+     default: None
+  read_timeout:
+     description:
+       - Seconds given to a kops read (eg: C(kops get)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 600
+  write_timeout:
+     description:
+       - Seconds given to a kops write (eg: C(kops replace), C(kops update cluster)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 1800
+  rolling_update_timeout:
+     description:
+       - Seconds given to a kops rolling update before its process group is stopped and the module fails. No timeout by default.
+       - Not applied to rolling updates started with I(rolling_update_progress_file).
+     type: int
+     required: false
+     default: None
+  task_timeout:
+     description:
+       - Seconds given to every kops command launched by the task. Commands are stopped once this deadline is reached.
+       - On timeout, commands already completed are sent back in I(completed_commands).
+     type: int
+     required: false
+     default: None
+  retries:
+     description:
+       - Number of times a failed kops command is launched again when its error is transient (eg: S3 C(SlowDown), API throttling, C(RequestLimitExceeded)).
+       - Only reads, C(kops replace), C(kops update cluster) and rolling update probes are retried. Other errors fail at once.
+     type: int
+     required: false
+     default: 3
+  retry_delay:
+     description:
+       - Base delay (seconds) between retries, doubled on each retry with random jitter (at most 60 seconds).
+     type: float
+     required: false
+     default: 1
+  rate_limit:
+     description:
+       - Maximum number of kops processes started per second against the state store (or I(rate_limit_key)), shared by every task and playbook of this host.
+       - Tokens are taken from a token bucket stored in I(rate_limit_dir) and locked with flock. No limit by default.
+     type: float
+     required: false
+     default: None
+  rate_limit_burst:
+     description:
+       - Number of kops processes which can be started at once before I(rate_limit) applies.
+     type: int
+     required: false
+     default: 5
+  rate_limit_key:
+     description:
+       - Name of the shared limit (eg: cloud account id) when several state stores use the same account. State store by default.
+     type: str
+     required: false
+     default: None
+  rate_limit_dir:
+     description:
+       - Directory of token buckets. C(kops-ansible-rate-limit) in temporary directory by default.
+     type: path
+     required: false
+     default: None
+  rolling_update_concurrency:
+     description:
+       - Roll instance groups needing update with one kops process each instead of one kops rolling update of the whole cluster.
+       - Masters are rolled first, one at a time, then at most I(rolling_update_concurrency) node groups are rolled at the same time.
+       - First failure stops every running rolling update. Duration of each instance group is sent back in I(rolling_update).
+     type: int
+     required: false
+     default: None
+  journal_dir:
+     description:
+       - Directory of a local journal recording a fingerprint of cluster and instance groups specifications (and kops version) once they are successfully applied.
+       - When specifications still match the journal, C(kops update cluster) and rolling update probe are skipped.
+       - Changes made outside of these modules are not detected, use I(force_apply) to check the cloud again.
+     type: path
+     required: false
+     default: None
+  force_apply:
+     description:
+       - Check and apply cloud changes even if the journal reports specifications as already applied.
+       - Without it, C(kops update cluster) is only run when the task changes cluster or instance groups specifications.
+     type: bool
+     required: false
+     default: false
+notes:
+   - kops bin is required
+   - boto3 is required to read s3:// state store without kops
+   - Module fails when one cluster can't be handled, other clusters are still handled and reported in I(clusters)
+author:
+   - Yannig Perré
+'''
+
+EXAMPLES = '''
+- name: Create and update clusters with kops
+  kops_fleet:
+    workers: 2
+    clusters:
+      - name: first.example.org
+        zones: eu-west-1a
+        state: updated
+      - name: second.example.org
+        zones: eu-west-1b
+        kubernetes_version: 1.11.6
+        state: updated
+      - name: old.example.org
+        state: absent
+'''
+
+RETURN = '''
+---
+clusters:
+   description: Result of every cluster (changed, failed, msg, spec_changes, change_impacts, spec_fingerprint, duration in seconds and kops statistics) keyed by cluster name
+   returned: always
+   type: dict
+duration:
+   description: Time spent (in seconds) handling every cluster
+   returned: always
+   type: float
+rolling_update:
+   description: Result of each instance group (name, status, duration in seconds) when I(rolling_update_concurrency) is set
+   returned: when instance groups are rolled
+   type: dict
+planned_commands:
+   description: kops commands (without kops binary and state store) which would have been launched to apply changes
+   returned: check mode
+   type: list
+timed_out:
+   description: True when a kops command has been stopped by I(read_timeout), I(write_timeout), I(rolling_update_timeout) or I(task_timeout)
+   returned: on timeout
+   type: bool
+completed_commands:
+   description: kops commands (without kops binary) completed before the timeout
+   returned: on timeout
+   type: list
+kops_trace:
+   description: One record per kops process launched with argv (secret values masked), start, duration (seconds), rc, stdout_bytes, stderr_bytes and caller (eg: get_nodes)
+   returned: always
+   type: list
+kops_invocations:
+   description: Number of kops processes launched by the module
+   returned: always
+   type: int
+kops_cached_reads:
+   description: Number of kops reads answered from cache instead of launching kops
+   returned: always
+   type: int
+state_store_reads:
+   description: Number of reads made straight from the state store instead of launching kops
+   returned: always
+   type: int
+kops_retries:
+   description: Number of kops commands launched again after a transient error
+   returned: always
+   type: int
+kops_retry_time:
+   description: Seconds spent waiting between retries
+   returned: always
+   type: float
+kops_rate_limit_wait:
+   description: Seconds spent waiting for the rate limiter before launching kops
+   returned: always
+   type: float
+'''
+
+
+class KopsFleetCluster(KopsClusterHandler):
+    """Handle state of one cluster of the fleet"""
+
+    def __init__(self, module, params, options_definition, kops_version, deadline):
+        super(KopsFleetCluster, self).__init__(
+            options_definition=options_definition,
+            module=KopsModuleView(module, params)
+        )
+        self.kops_version = kops_version
+        # Clusters share the deadline of the task
+        self.deadline = deadline
+
+
+class KopsFleet(Kops):
+    """Handle state for a list of kops clusters"""
+
+    def __init__(self):
+        """Init module parameters"""
+        additional_module_args = dict(
+            clusters=dict(type='list', elements='dict', required=True, options=dict(
+                name=dict(type=str, required=True),
+                state=dict(choices=['present', 'absent', 'updated'], default='present'),
+                cloud=dict(choices=['gce', 'aws', 'vsphere'], default='aws'),
+                docker=dict(type=dict),
+                additional_policies=dict(
+                    type=dict, aliases=['additional-policies', 'additionalPolicies']
+                ),
+                admin_access=dict(type=str, aliases=['admin-access']),
+                api_loadbalancer_type=dict(type=str, aliases=['api-loadbalancer-type']),
+                api_ssl_certificate=dict(type=str, aliases=['api-ssl-certificate']),
+                associate_public_ip=dict(type=bool, aliases=['associate-public-ip']),
+                authorization=dict(type=str),
+                bastion=dict(type=bool),
+                channel=dict(type=str),
+
+                cloud_labels=dict(type=str, aliases=['cloud-labels']),
+                disable_subnet_tags=dict(type=bool, aliases=['disable-subnet-tags']),
+                dns=dict(type=str),
+                dns_zone=dict(type=str, aliases=['dns-zone']),
+                dry_run=dict(type=bool, aliases=['dry-run']),
+                encrypt_etcd_storage=dict(type=bool, aliases=['encrypt-etcd-storage']),
+                image=dict(type=str),
+                kubernetes_version=dict(type=str, aliases=['kubernetes-version']),
+                master_count=dict(type=int, aliases=['master-count']),
+                master_public_name=dict(type=str, aliases=['master-public-name']),
+                master_security_groups=dict(type=str, aliases=['master-security-groups']),
+                master_size=dict(type=str, aliases=['master-size']),
+                master_tenancy=dict(type=str, aliases=['master-tenancy']),
+                master_volume_size=dict(type=int, aliases=['master-volume-size']),
+                master_zones=dict(type=str, aliases=['master-zones']),
+                model=dict(type=str),
+                network_cidr=dict(type=str, aliases=['network-cidr']),
+                networking=dict(type=str),
+                node_count=dict(type=int, aliases=['node-count']),
+                node_security_groups=dict(type=str, aliases=['node-security-groups']),
+                node_size=dict(type=str, aliases=['node-size']),
+                node_tenancy=dict(type=str, aliases=['node-tenancy']),
+                node_volume_size=dict(type=int, aliases=['node-volume-size']),
+                out=dict(type=str),
+                project=dict(type=str),
+                ssh_access=dict(type=str, aliases=['ssh-access']),
+                ssh_public_key=dict(type=str, aliases=['ssh-public-key']),
+                subnets=dict(type=str),
+                target=dict(type=str),
+                topology=dict(type=str),
+                utility_subnets=dict(type=str, aliases=['utility-subnets']),
+                vpc=dict(type=str),
+                zones=dict(type=str),
+                bastion_interval=dict(type=str, aliases=['bastion-interval']),
+                cloudonly=dict(type=bool),
+                fail_on_drain_error=dict(type=bool, aliases=['fail-on-drain-error']),
+                fail_on_validate_error=dict(type=bool, aliases=['fail-on-validate-error']),
+                force=dict(type=bool),
+                instance_group=dict(type=str, aliases=['instance-group']),
+                instance_group_roles=dict(type=str, aliases=['instance-group-roles']),
+                master_interval=dict(type=str, aliases=['master-interval']),
+                node_interval=dict(type=str, aliases=['node-interval']),
+            )),
+            workers=dict(type=int, default=4),
+            rolling_update_concurrency=dict(type=int),
+            journal_dir=dict(type='path'),
+            force_apply=dict(type=bool, default=False),
+        )
+        # pylint: disable=line-too-long
+        options_definition = {
+            'admin_access': {'name': 'admin_access', 'alias': 'admin-access', 'type': 'list', 'help': 'Restrict API access to this CIDR.  If not set, access will not be restricted by IP.', 'default': "'[0.0.0.0/0]'", 'tag': 'create'},
+            'api_loadbalancer_type': {'name': 'api_loadbalancer_type', 'alias': 'api-loadbalancer-type', 'type': 'str', 'help': "Sets the API loadbalancer type to either 'public' or 'internal'", 'default': None, 'tag': 'create'},
+            'api_ssl_certificate': {'name': 'api_ssl_certificate', 'alias': 'api-ssl-certificate', 'type': 'str', 'help': 'Currently only supported in AWS. Sets the ARN of the SSL Certificate to use for the API server loadbalancer.', 'default': None, 'tag': 'create'},
+            'associate_public_ip': {'name': 'associate_public_ip', 'alias': 'associate-public-ip', 'type': 'bool', 'help': "Specify --associate-public-ip=[true|false] to enable/disable association of public IP for master ASG and nodes. Default is 'true'.", 'default': None, 'tag': 'create'},
+            'authorization': {'name': 'authorization', 'alias': 'authorization', 'type': 'str', 'help': 'Authorization mode to use: AlwaysAllow or RBAC', 'default': "'RBAC'", 'tag': 'create'},
+            'bastion': {'name': 'bastion', 'alias': 'bastion', 'type': 'bool', 'help': 'Pass the --bastion flag to enable a bastion instance group. Only applies to private topology.', 'default': None, 'tag': 'create'},
+            'channel': {'name': 'channel', 'alias': 'channel', 'type': 'str', 'help': 'Channel for default versions and configuration to use', 'default': "'stable'", 'tag': 'create'},
+            'cloud': {'name': 'cloud', 'alias': 'cloud', 'type': 'str', 'help': 'Cloud provider to use - gce, aws, vsphere', 'default': None, 'tag': 'create'},
+            'cloud_labels': {'name': 'cloud_labels', 'alias': 'cloud-labels', 'type': 'str', 'help': 'A list of KV pairs used to tag all instance groups in AWS (eg "Owner=John Doe,Team=Some Team").', 'default': None, 'tag': 'create'},
+            'disable_subnet_tags': {'name': 'disable_subnet_tags', 'alias': 'disable-subnet-tags', 'type': 'bool', 'help': 'Set to disable automatic subnet tagging', 'default': None, 'tag': 'create'},
+            'dns': {'name': 'dns', 'alias': 'dns', 'type': 'str', 'help': 'DNS hosted zone to use: public|private.', 'default': "'Public'", 'tag': 'create'},
+            'dns_zone': {'name': 'dns_zone', 'alias': 'dns-zone', 'type': 'str', 'help': 'DNS hosted zone to use (defaults to longest matching zone)', 'default': None, 'tag': 'create'},
+            'dry_run': {'name': 'dry_run', 'alias': 'dry-run', 'type': 'bool', 'help': 'If true, only print the object that would be sent, without sending it. This flag can be used to create a cluster YAML or JSON manifest.', 'default': None, 'tag': 'create'},
+            'encrypt_etcd_storage': {'name': 'encrypt_etcd_storage', 'alias': 'encrypt-etcd-storage', 'type': 'bool', 'help': 'Generate key in aws kms and use it for encrypt etcd volumes', 'default': None, 'tag': 'create'},
+            'image': {'name': 'image', 'alias': 'image', 'type': 'str', 'help': 'Image to use for all instances.', 'default': None, 'tag': 'create'},
+            'kubernetes_version': {'name': 'kubernetes_version', 'alias': 'kubernetes-version', 'type': 'str', 'help': 'Version of kubernetes to run (defaults to version in channel)', 'default': None, 'tag': 'create'},
+            'master_count': {'name': 'master_count', 'alias': 'master-count', 'type': 'int', 'help': 'Set the number of masters.  Defaults to one master per master-zone', 'default': None, 'tag': 'create'},
+            'master_public_name': {'name': 'master_public_name', 'alias': 'master-public-name', 'type': 'str', 'help': 'Sets the public master public name', 'default': None, 'tag': 'create'},
+            'master_security_groups': {'name': 'master_security_groups', 'alias': 'master-security-groups', 'type': 'list', 'help': 'Add precreated additional security groups to masters.', 'default': None, 'tag': 'create'},
+            'master_size': {'name': 'master_size', 'alias': 'master-size', 'type': 'str', 'help': 'Set instance size for masters', 'default': None, 'tag': 'create'},
+            'master_tenancy': {'name': 'master_tenancy', 'alias': 'master-tenancy', 'type': 'str', 'help': 'The tenancy of the master group on AWS. Can either be default or dedicated.', 'default': None, 'tag': 'create'},
+            'master_volume_size': {'name': 'master_volume_size', 'alias': 'master-volume-size', 'type': 'int', 'help': 'Set instance volume size (in GB) for masters', 'default': None, 'tag': 'create'},
+            'master_zones': {'name': 'master_zones', 'alias': 'master-zones', 'type': 'list', 'help': 'Zones in which to run masters (must be an odd number)', 'default': None, 'tag': 'create'},
+            'model': {'name': 'model', 'alias': 'model', 'type': 'str', 'help': 'Models to apply (separate multiple models with commas)', 'default': "'proto,cloudup'", 'tag': 'create'},
+            'network_cidr': {'name': 'network_cidr', 'alias': 'network-cidr', 'type': 'str', 'help': 'Set to override the default network CIDR', 'default': None, 'tag': 'create'},
+            'networking': {'name': 'networking', 'alias': 'networking', 'type': 'str', 'help': 'Networking mode to use.  kubenet (default), classic, external, kopeio-vxlan (or kopeio), weave, flannel-vxlan (or flannel), flannel-udp, calico, canal, kube-router, romana, amazon-vpc-routed-eni, cilium.', 'default': "'kubenet'", 'tag': 'create'},
+            'node_count': {'name': 'node_count', 'alias': 'node-count', 'type': 'int', 'help': 'Set the number of nodes', 'default': None, 'tag': 'create'},
+            'node_security_groups': {'name': 'node_security_groups', 'alias': 'node-security-groups', 'type': 'list', 'help': 'Add precreated additional security groups to nodes.', 'default': None, 'tag': 'create'},
+            'node_size': {'name': 'node_size', 'alias': 'node-size', 'type': 'str', 'help': 'Set instance size for nodes', 'default': None, 'tag': 'create'},
+            'node_tenancy': {'name': 'node_tenancy', 'alias': 'node-tenancy', 'type': 'str', 'help': 'The tenancy of the node group on AWS. Can be either default or dedicated.', 'default': None, 'tag': 'create'},
+            'node_volume_size': {'name': 'node_volume_size', 'alias': 'node-volume-size', 'type': 'int', 'help': 'Set instance volume size (in GB) for nodes', 'default': None, 'tag': 'create'},
+            'out': {'name': 'out', 'alias': 'out', 'type': 'str', 'help': 'Path to write any local output', 'default': None, 'tag': 'create'},
+            'project': {'name': 'project', 'alias': 'project', 'type': 'str', 'help': 'Project to use (must be set on GCE)', 'default': None, 'tag': 'create'},
+            'ssh_access': {'name': 'ssh_access', 'alias': 'ssh-access', 'type': 'list', 'help': 'Restrict SSH access to this CIDR.  If not set, access will not be restricted by IP.', 'default': "'[0.0.0.0/0]'", 'tag': 'create'},
+            'ssh_public_key': {'name': 'ssh_public_key', 'alias': 'ssh-public-key', 'type': 'str', 'help': 'SSH public key to use (defaults to ~/.ssh/id_rsa.pub on AWS)', 'default': None, 'tag': 'create'},
+            'subnets': {'name': 'subnets', 'alias': 'subnets', 'type': 'list', 'help': 'Set to use shared subnets', 'default': None, 'tag': 'create'},
+            'target': {'name': 'target', 'alias': 'target', 'type': 'str', 'help': 'Valid targets: direct, terraform, cloudformation. Set this flag to terraform if you want kops to generate terraform', 'default': "'direct'", 'tag': 'create'},
+            'topology': {'name': 'topology', 'alias': 'topology', 'type': 'str', 'help': 'Controls network topology for the cluster: public|private.', 'default': "'public'", 'tag': 'create'},
+            'utility_subnets': {'name': 'utility_subnets', 'alias': 'utility-subnets', 'type': 'list', 'help': 'Set to use shared utility subnets', 'default': None, 'tag': 'create'},
+            'vpc': {'name': 'vpc', 'alias': 'vpc', 'type': 'str', 'help': 'Set to use a shared VPC', 'default': None, 'tag': 'create'},
+            'zones': {'name': 'zones', 'alias': 'zones', 'type': 'list', 'help': 'Zones in which to run the cluster', 'default': None, 'tag': 'create'},
+            'bastion_interval': {'name': 'bastion_interval', 'alias': 'bastion-interval', 'type': 'str', 'help': 'Time to wait between restarting bastions', 'default': "'5m0s'", 'tag': 'rolling-update'},
+            'cloudonly': {'name': 'cloudonly', 'alias': 'cloudonly', 'type': 'bool', 'help': 'Perform rolling update without confirming progress with k8s', 'default': None, 'tag': 'rolling-update'},
+            'fail_on_drain_error': {'name': 'fail_on_drain_error', 'alias': 'fail-on-drain-error', 'type': 'bool', 'help': 'The rolling-update will fail if draining a node fails.', 'default': "'true'", 'tag': 'rolling-update'},
+            'fail_on_validate_error': {'name': 'fail_on_validate_error', 'alias': 'fail-on-validate-error', 'type': 'bool', 'help': 'The rolling-update will fail if the cluster fails to validate.', 'default': "'true'", 'tag': 'rolling-update'},
+            'force': {'name': 'force', 'alias': 'force', 'type': 'bool', 'help': 'Force rolling update, even if no changes', 'default': None, 'tag': 'rolling-update'},
+            'instance_group': {'name': 'instance_group', 'alias': 'instance-group', 'type': 'list', 'help': 'List of instance groups to update (defaults to all if not specified)', 'default': None, 'tag': 'rolling-update'},
+            'instance_group_roles': {'name': 'instance_group_roles', 'alias': 'instance-group-roles', 'type': 'list', 'help': 'If specified, only instance groups of the specified role will be updated (e.g. Master,Node,Bastion)', 'default': None, 'tag': 'rolling-update'},
+            'master_interval': {'name': 'master_interval', 'alias': 'master-interval', 'type': 'str', 'help': 'Time to wait between restarting masters', 'default': "'5m0s'", 'tag': 'rolling-update'},
+            'node_interval': {'name': 'node_interval', 'alias': 'node-interval', 'type': 'str', 'help': 'Time to wait between restarting nodes', 'default': "'4m0s'", 'tag': 'rolling-update'},
+        }
+        super(KopsFleet, self).__init__(
+            additional_module_args, options_definition, supports_check_mode=True
+        )
+
+
+    def get_cluster_params(self, cluster):
+        """Send back module parameters overridden by cluster definition"""
+        params = dict(self.module.params)
+        del params['clusters']
+        for (param, value) in iteritems(cluster):
+            if value is not None or param not in params:
+                params[param] = value
+        return params
+
+
+    def check_cluster_state(self, cluster):
+        """Bring one cluster to its expected state (every step of the cluster is run in order)"""
+        start = time.time()
+        handler = KopsFleetCluster(
+            self.module, self.get_cluster_params(cluster),
+            self.options_definition, self.get_kops_version() or (), self.deadline
+        )
+        try:
+            results = handler.check_cluster_state()
+            handler.flush_cluster_updates()
+            results['failed'] = False
+        except KopsError as e:
+            results = dict(e.results, cluster_name=cluster['name'], changed=False, failed=True)
+        results['spec_changes'] = handler.spec_changes
+        with self._lock:
+            self.kops_trace += handler.kops_trace
+        if self.module.check_mode:
+            results['planned_commands'] = handler.get_planned_commands()
+            with self._lock:
+                self.planned_commands += handler.planned_commands
+        results['duration'] = round(time.time() - start, 3)
+        results.update(handler.get_kops_statistics())
+        return results
+
+
+    def exit_json(self):
+        """Send back result to Ansible"""
+        names = [cluster['name'] for cluster in self.module.params['clusters']]
+        duplicates = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicates:
+            self.module_fail_json(msg="Clusters listed more than once: %s" % ", ".join(duplicates))
+
+        # kops version is detected once for every cluster
+        self.get_kops_version()
+
+        start = time.time()
+        clusters = dict(zip(names, self._map_in_pool(
+            self.check_cluster_state,
+            self.module.params['clusters'],
+            workers=self.module.params['workers']
+        )))
+
+        for results in clusters.values():
+            self.kops_invocations += results['kops_invocations']
+            self.kops_cached_reads += results['kops_cached_reads']
+            self.state_store_reads += results['state_store_reads']
+            self.kops_retries += results['kops_retries']
+            self.kops_retry_time += results['kops_retry_time']
+            self.kops_rate_limit_wait += results['kops_rate_limit_wait']
+
+        results = dict(
+            changed=any(r['changed'] for r in clusters.values()),
+            clusters=clusters,
+            duration=round(time.time() - start, 3),
+        )
+        failed = sorted(name for (name, r) in iteritems(clusters) if r['failed'])
+        if failed:
+            self.module_fail_json(
+                msg="Unable to handle clusters: %s" % ", ".join(failed),
+                **results
+            )
+
+        self.module_exit_json(**results)
+
+
+def main():
+    """Kops fleet handling"""
+    fleet = KopsFleet()
+    fleet.exit_json()
+
+
+if __name__ == '__main__':
+    main()
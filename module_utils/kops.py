@@ -10,12 +10,41 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import os
 import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.six import iteritems
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.module_utils.kops_cache import KopsDiskCache
+from ansible.module_utils.kops_diff import get_changed_paths
+from ansible.module_utils.kops_impact import (
+    get_change_impacts, ROLL_MASTERS, ROLL_NODES, UPDATE_ONLY
+)
+from ansible.module_utils.kops_journal import KopsJournal, get_spec_fingerprint
+from ansible.module_utils.kops_process import run_process, start_process, start_timer
+from ansible.module_utils.kops_rate_limit import KopsRateLimiter
+from ansible.module_utils.kops_retry import classify_error, get_backoff, RETRYABLE
+from ansible.module_utils.kops_progress import (
+    get_rolling_update_timings, parse_rolling_update_output, start_detached, RollingUpdateRunning
+)
+from ansible.module_utils.kops_rolling_update import KopsRollingUpdate, parse_rolling_update_status
+from ansible.module_utils.kops_serialization import (
+    dump_all, load_documents, load_yaml_documents, LineStream
+)
+from ansible.module_utils.kops_state_store import get_state_store_reader, StateStoreError
+from ansible.module_utils.kops_trace import append_trace, mask_secrets, start_profiler
 from ansible.utils.vars import merge_hash
-import yaml
+
+
+# Comments added by kops in fully populated specification
+FULL_SPEC_COMMENT_RE = re.compile(r'^\s*//.*')
 
 
 def to_camel_case(snake_str):
@@ -29,6 +58,45 @@ def to_camel_case(snake_str):
     return components[0] + ''.join(x.title() for x in components[1:])
 
 
+def parse_kops_version(version_output):
+    """
+        Extract kops version as a tuple from `kops version` output
+        Version 1.11.0 (git-2c2042465) => (1, 11, 0)
+    """
+    match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', version_output)
+    if match is None:
+        return None
+    return tuple(int(x or 0) for x in match.groups())
+
+
+class KopsError(Exception):
+    """Failure of a Kops object driven by another module (see KopsModuleView)"""
+
+    def __init__(self, msg, **kwargs):
+        super(KopsError, self).__init__(msg)
+        self.results = dict(kwargs, msg=msg)
+
+
+class KopsModuleView():
+    """
+        Module seen by a Kops object handling one item of a module parameter (eg: one cluster)
+        Parameters are item parameters and failures raise KopsError instead of exiting
+    """
+
+    def __init__(self, module, params):
+        self.module = module
+        self.params = params
+
+
+    def fail_json(self, msg, **kwargs):
+        """Report failure of this item only"""
+        raise KopsError(msg, **kwargs)
+
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
 class Kops():
     """handle kops communication by detecting kops bin path and setting kops options"""
 
@@ -40,23 +108,91 @@ class Kops():
         state_store=dict(type='str'),
         name=dict(type='str'),
         kops_cmd=dict(type='str'),
+        cache_dir=dict(type='path'),
+        cache_ttl=dict(type='int', default=300),
+        direct_read=dict(type='bool', default=False),
+        state_store_endpoint=dict(type='str'),
+        wire_format=dict(choices=['auto', 'json', 'yaml'], default='auto'),
+        trace_file=dict(type='path'),
+        profile_file=dict(type='path'),
+        read_timeout=dict(type='int', default=600),
+        write_timeout=dict(type='int', default=1800),
+        rolling_update_timeout=dict(type='int'),
+        task_timeout=dict(type='int'),
+        retries=dict(type='int', default=3),
+        retry_delay=dict(type='float', default=1),
+        rate_limit=dict(type='float'),
+        rate_limit_burst=dict(type='int', default=5),
+        rate_limit_key=dict(type='str'),
+        rate_limit_dir=dict(type='path'),
     )
     optional_module_args = None
     options_definition = {}
+    kops_version = None
+    disk_cache = None
+    journal = None
+    rate_limiter = None
+    state_store_reader = None
+    kops_invocations = 0
+    kops_cached_reads = 0
+    state_store_reads = 0
+    kops_retries = 0
+    kops_retry_time = 0
+    kops_rate_limit_wait = 0
+    # kops commands that only read the state store and can be answered from cache
+    read_commands = ['get', 'version']
+    # Commands which only report what would be done unless --yes is given
+    preview_commands = ['update', 'rolling-update']
+    # Writes giving the same result when launched again (reads are always safe to retry)
+    idempotent_commands = ['replace', 'update']
+    # Write commands whose impact is classified from changed spec fields
+    spec_commands = ['replace']
+    default_read_workers = 4
+    # First kops release able to print a cluster and its instance groups with `kops get`
+    combined_get_min_version = (1, 9)
+    # First kops release able to read and print kops objects as JSON
+    json_min_version = (1, 8)
 
-    def __init__(self, additional_module_args=None, options_definition=None):
-        """Init Ansible module options"""
+    def __init__(self, additional_module_args=None, options_definition=None, module=None,
+                 **module_options):
+        """Init Ansible module options (or reuse module already initialized)"""
         if additional_module_args is not None:
             self.additional_module_args = additional_module_args
 
-        self.module = AnsibleModule(
-            argument_spec=dict(
-                self.default_module_args,
-                **additional_module_args
+        if module is not None:
+            self.module = module
+        else:
+            self.module = AnsibleModule(
+                argument_spec=dict(
+                    self.default_module_args,
+                    **additional_module_args
+                ),
+                **module_options
             )
-        )
+            if self.module.params['profile_file'] is not None:
+                start_profiler(self.module.params['profile_file'])
         if options_definition is not None:
             self.options_definition = options_definition
+        self._lock = threading.Lock()
+        self._read_cache = {}
+        # Clusters whose definition has been changed without `kops update cluster` yet
+        self.pending_cluster_updates = []
+        # Spec paths really changed, keyed by object name
+        self.spec_changes = {}
+        # Impacts of changes made to clusters (None when unknown), keyed by cluster name
+        self.change_impacts = {}
+        # Write commands not launched in check mode
+        self.planned_commands = []
+        # Instance groups created in check mode (unknown to kops), keyed by cluster name
+        self.planned_instance_groups = {}
+        # One record per kops process launched
+        self.kops_trace = []
+        # Function which spread work to pool workers, used as caller in traces
+        self._pool_context = threading.local()
+        # Every kops command of the task must be done before deadline
+        self.deadline = None
+        if self.module.params.get('task_timeout'):
+            self.deadline = time.time() + self.module.params['task_timeout']
         self._detect_kops_cmd()
 
 
@@ -67,176 +203,1068 @@ class Kops():
             self.kops_cmd = self.module.get_bin_path('kops')
 
         if self.kops_cmd is None:
-            self.module.fail_json(msg="Unable to locate kops binary")
+            self.module_fail_json(msg="Unable to locate kops binary")
 
         if self.module.params['state_store'] is not None:
-            self.kops_args += ['--state', self.module.params['state_store']]
+            self.kops_args = self.kops_args + ['--state', self.module.params['state_store']]
 
 
-    def _get_optional_args(self, tag=None):
+    def _get_optional_args(self, tag=None, params=None):
         if tag is None:
             return []
 
+        if params is None:
+            params = self.module.params
+
         optional_args = []
         # Construct command to launch using options definition
         for k, v in iteritems(self.options_definition):
             if v.get('tag') != tag:
                 continue
 
-            if self.module.params[k] is None:
+            if params.get(k) is None:
                 continue
 
             if v['type'] == 'bool':
-                if bool(self.module.params[k]):
+                if bool(params[k]):
                     optional_args += ['--' + v['alias']]
             else:
-                optional_args += ['--' + v['alias'], str(self.module.params[k])]
+                optional_args += ['--' + v['alias'], str(params[k])]
 
         return optional_args
 
 
-    def run_command(self, options, add_optional_args_from_tag=None, data=None):
-        """Run kops using kops arguments"""
-        optional_args = self._get_optional_args(tag=add_optional_args_from_tag)
+    @staticmethod
+    def _get_command_cluster_name(options):
+        """Find cluster targeted by a kops command (None if unknown)"""
+        if '--name' in options[:-1]:
+            return options[options.index('--name') + 1]
+        if len(options) > 2 and options[1] == 'cluster':
+            return options[2]
+        return None
+
+
+    def get_state_store(self):
+        """State store used by kops (module parameter or KOPS_STATE_STORE)"""
+        state_store = self.module.params['state_store']
+        if state_store is None:
+            state_store = os.environ.get('KOPS_STATE_STORE', '')
+        return state_store
+
+
+    def get_state_store_reader(self):
+        """Reader retrieving kops objects without kops (None if state store is not supported)"""
+        if self.state_store_reader is None:
+            self.state_store_reader = get_state_store_reader(
+                self.get_state_store(),
+                self.module.params.get('state_store_endpoint')
+            ) or False
+        return self.state_store_reader or None
+
+
+    def _get_direct_reader(self):
+        """State store reader used in place of kops for reads (None if direct reads are disabled)"""
+        if not self.module.params.get('direct_read'):
+            return None
+        return self.get_state_store_reader()
+
+
+    def _get_disk_cache(self):
+        """Persistent cache of kops reads (None if cache_dir is not set)"""
+        if self.disk_cache is None and self.module.params.get('cache_dir'):
+            self.disk_cache = KopsDiskCache(
+                self.module.params['cache_dir'],
+                self.get_state_store(),
+                self.get_kops_version(),
+                self.module.params['cache_ttl'],
+                self.get_state_store_reader()
+            )
+        return self.disk_cache
+
+
+    def _get_journal(self):
+        """Journal of applied specifications (None if journal_dir is not set)"""
+        if self.journal is None and self.module.params.get('journal_dir'):
+            self.journal = KopsJournal(self.module.params['journal_dir'], self.get_state_store())
+        return self.journal
+
+
+    def _get_rate_limiter(self):
+        """Limiter shared by kops processes of a state store or account (None without rate_limit)"""
+        if self.rate_limiter is None and self.module.params.get('rate_limit'):
+            self.rate_limiter = KopsRateLimiter(
+                self.module.params.get('rate_limit_dir')
+                or os.path.join(tempfile.gettempdir(), 'kops-ansible-rate-limit'),
+                self.module.params.get('rate_limit_key') or self.get_state_store(),
+                self.module.params['rate_limit'],
+                self.module.params.get('rate_limit_burst', 5)
+            )
+        return self.rate_limiter
+
+
+    def wait_rate_limit(self, deadline=None):
+        """Wait until kops can be launched (False when it can't be done before deadline)"""
+        rate_limiter = self._get_rate_limiter()
+        if rate_limiter is None:
+            return True
+        waited = rate_limiter.acquire(deadline)
+        if waited is None:
+            return False
+        with self._lock:
+            self.kops_rate_limit_wait += waited
+        return True
+
+
+    def _get_cached_read(self, options):
+        """Send back result of a previous read command (None if not available)"""
+        options = tuple(options)
+        with self._lock:
+            result = self._read_cache.get(options)
+        if result is not None or options[0] == 'version':
+            return result
+
+        disk_cache = self._get_disk_cache()
+        if disk_cache is not None:
+            result = disk_cache.get(self._get_command_cluster_name(options), options)
+            if result is not None:
+                with self._lock:
+                    self._read_cache[options] = result
+        return result
+
+
+    def _store_read(self, options, result):
+        """Keep result of a successful read command in memory and on disk"""
+        options = tuple(options)
+        with self._lock:
+            self._read_cache[options] = result
+        # kops version is stored apart as it's part of cache keys
+        if options[0] == 'version':
+            return
+        disk_cache = self._get_disk_cache()
+        if disk_cache is not None:
+            disk_cache.set(self._get_command_cluster_name(options), options, result)
+
+
+    def _invalidate_read_cache(self, cluster_name=None):
+        """Forget cached reads of a cluster (every cached read if cluster is unknown)"""
+        with self._lock:
+            for key in list(self._read_cache):
+                if key[0] == 'version':
+                    continue
+                # Listing of all clusters contains this cluster too
+                if cluster_name is None or '--name' not in key or cluster_name in key:
+                    del self._read_cache[key]
+
+        disk_cache = self._get_disk_cache()
+        if disk_cache is not None:
+            disk_cache.invalidate(cluster_name)
+
+
+    def run_command(self, options, add_optional_args_from_tag=None, data=None, cluster_name=None,
+                    params=None):
+        """
+            Run kops using kops arguments
+            Optional arguments are taken from params (module parameters by default)
+        """
+        caller = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
+        if caller == 'run':
+            # Called by a pool worker
+            caller = getattr(self._pool_context, 'caller', caller)
+        optional_args = self._get_optional_args(tag=add_optional_args_from_tag, params=params)
+
+        is_read = options[0] in self.read_commands and data is None
+        if is_read:
+            cache_key = tuple(options + optional_args)
+            cached_result = self._get_cached_read(cache_key)
+            if cached_result is not None:
+                with self._lock:
+                    self.kops_cached_reads += 1
+                return cached_result
+        elif options[0] not in self.preview_commands or "--yes" in options:
+            if cluster_name is None:
+                cluster_name = self._get_command_cluster_name(options)
+            if options[0] not in self.preview_commands + self.spec_commands:
+                # Impact of other writes (eg: instance group creation) is unknown
+                self.add_change_impacts(cluster_name, None)
+            if self.module.check_mode:
+                # Nothing is changed in check mode: command is only reported
+                self.planned_commands.append(options + optional_args)
+                return (0, '', '')
+            # Any write may change objects read until now
+            self._invalidate_read_cache(cluster_name)
+            # Specification applied until now may change
+            if options[0] not in self.preview_commands and self._get_journal() is not None:
+                self._get_journal().forget(cluster_name)
+
+        cmd = [self.kops_cmd] + self.kops_args + options + optional_args
+        with self._lock:
+            self.kops_invocations += 1
 
+        attempt = 0
+        while True:
+            if not self.wait_rate_limit(self.deadline):
+                self.fail_on_timeout(cmd, 0)
+            # Time spent waiting for the rate limiter is not given to kops
+            timeout = self.get_command_timeout(options)
+            if timeout == 0:
+                self.fail_on_timeout(cmd, timeout)
+            start = time.time()
+            try:
+                (rc, out, err, timed_out) = run_process(cmd, data=data, timeout=timeout)
+            # pylint: disable=broad-except
+            except Exception as e:
+                self.record_trace(cmd, start, None, caller=caller)
+                self.module_fail_json(
+                    exception=e,
+                    msg="error while launching kops",
+                    kops_cmd=self.kops_cmd,
+                    kops_args=self.kops_args,
+                    kops_options=options,
+                    optional_args=optional_args,
+                    cmd=cmd
+                )
+            self.record_trace(cmd, start, rc, len(to_bytes(out)), len(to_bytes(err)), caller=caller)
+            if timed_out:
+                self.fail_on_timeout(cmd, timeout, stdout=out, stderr=err)
+            delay = self.get_retry_delay(options, rc, err, attempt)
+            if delay is None:
+                break
+            self._wait_before_retry(delay)
+            attempt += 1
+
+        result = (rc, out, err)
+        if is_read and rc == 0:
+            self._store_read(cache_key, result)
+        return result
+
+
+    def get_command_timeout(self, options):
+        """
+            Seconds given to a kops command (None if unlimited): timeout of the command class
+            (read, write or rolling update) bounded by the task deadline
+        """
+        if options[0] in self.read_commands:
+            timeout = self.module.params.get('read_timeout')
+        elif options[0] == 'rolling-update' and '--yes' in options:
+            timeout = self.module.params.get('rolling_update_timeout')
+        else:
+            timeout = self.module.params.get('write_timeout')
+
+        if self.deadline is not None:
+            remaining = max(0, self.deadline - time.time())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+
+    def is_retryable_command(self, options):
+        """Check if a kops command can be launched again after a failure"""
+        if options[0] in self.read_commands + self.idempotent_commands:
+            return True
+        # Rolling update probe (without --yes) only reads cloud state
+        return options[0] == 'rolling-update' and '--yes' not in options
+
+
+    def get_retry_delay(self, options, rc, err, attempt):
+        """
+            Seconds to wait before launching a failed kops command again
+            None when command must not be retried (success, fatal or unknown error,
+            unsafe command, retries exhausted or task deadline too close)
+        """
+        if rc == 0 or attempt >= self.module.params.get('retries', 0):
+            return None
+        if not self.is_retryable_command(options) or classify_error(err) != RETRYABLE:
+            return None
+        delay = get_backoff(attempt, self.module.params.get('retry_delay', 1))
+        if self.deadline is not None and time.time() + delay >= self.deadline:
+            return None
+        return delay
+
+
+    def _wait_before_retry(self, delay):
+        time.sleep(delay)
+        with self._lock:
+            self.kops_retries += 1
+            self.kops_retry_time += delay
+            self.kops_invocations += 1
+
+
+    def fail_on_timeout(self, cmd, timeout, **results):
+        """Fail with kops commands completed so far"""
+        if timeout == 0:
+            msg = "Task deadline reached before running kops (or before rate limiter allows it)"
+        else:
+            msg = "kops command stopped after %s seconds" % round(timeout, 1)
+        results.update(
+            timed_out=True,
+            cmd=mask_secrets(cmd),
+            completed_commands=[
+                record['argv'][1:] for record in self.kops_trace if record['rc'] == 0
+            ],
+            kops_trace=self.kops_trace,
+        )
+        if getattr(self._pool_context, 'caller', None) is not None:
+            # Pool workers hand the failure back to the main thread
+            raise KopsError(msg, **results)
+        self.module_fail_json(msg=msg, **results)
+
+
+    def record_trace(self, cmd, start, rc, stdout_bytes=None, stderr_bytes=None, caller=None):
+        """Record a kops invocation in kops_trace (and trace_file when set)"""
+        record = dict(
+            argv=mask_secrets(cmd),
+            start=round(start, 3),
+            duration=round(time.time() - start, 3),
+            rc=rc,
+            stdout_bytes=stdout_bytes,
+            stderr_bytes=stderr_bytes,
+            caller=caller,
+        )
+        with self._lock:
+            self.kops_trace.append(record)
+        if self.module.params.get('trace_file'):
+            append_trace(self.module.params['trace_file'], record)
+
+
+    def start_command(self, options, **popen_options):
+        """
+            Launch kops in its own process group without waiting for it
+            (caller is in charge of the process and of its timeout)
+        """
+        self._invalidate_read_cache(self._get_command_cluster_name(options))
+        with self._lock:
+            self.kops_invocations += 1
+        self.wait_rate_limit()
+        return start_process([self.kops_cmd] + self.kops_args + options, **popen_options)
+
+
+    def run_command_stream(self, options):
+        """
+            Run kops and read its output line by line instead of waiting for the whole output
+            Send back (lines, status): status is filled with 'rc' and 'err' once lines are consumed
+        """
+        with self._lock:
+            self.kops_invocations += 1
+
+        caller = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
+        cmd = [self.kops_cmd] + self.kops_args + options
+        if not self.wait_rate_limit(self.deadline):
+            self.fail_on_timeout(cmd, 0)
+        timeout = self.get_command_timeout(options)
+        if timeout == 0:
+            self.fail_on_timeout(cmd, timeout)
+        status = {}
+
+        def read_lines():
+            command_timeout = timeout
+            attempt = 0
+            while True:
+                start = time.time()
+                stdout_bytes = 0
+                # stderr goes to a file so that kops never blocks on a full pipe
+                stderr = tempfile.TemporaryFile()
+                try:
+                    process = start_process(
+                        cmd, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True
+                    )
+                except OSError as e:
+                    stderr.close()
+                    self.module_fail_json(
+                        exception=e,
+                        msg="error while launching kops",
+                        kops_cmd=self.kops_cmd,
+                        kops_args=self.kops_args,
+                        kops_options=options,
+                        cmd=cmd
+                    )
+
+                (timer, timed_out) = start_timer(process, command_timeout)
+                try:
+                    for line in iter(process.stdout.readline, ''):
+                        stdout_bytes += len(to_bytes(line))
+                        yield line
+                finally:
+                    process.stdout.close()
+                    status['rc'] = process.wait()
+                    if timer is not None:
+                        timer.cancel()
+                    stderr.seek(0)
+                    status['err'] = to_text(stderr.read())
+                    stderr.close()
+                    self.record_trace(
+                        cmd, start, status['rc'],
+                        stdout_bytes, len(to_bytes(status['err'])), caller=caller
+                    )
+                if timed_out.is_set():
+                    self.fail_on_timeout(cmd, command_timeout, stderr=status['err'])
+
+                # Lines already handed to the caller can't be read again
+                delay = None
+                if stdout_bytes == 0:
+                    delay = self.get_retry_delay(options, status['rc'], status['err'], attempt)
+                if delay is None:
+                    return
+                self._wait_before_retry(delay)
+                attempt += 1
+                if not self.wait_rate_limit(self.deadline):
+                    self.fail_on_timeout(cmd, 0)
+                command_timeout = self.get_command_timeout(options)
+                if command_timeout == 0:
+                    self.fail_on_timeout(cmd, command_timeout)
+
+        return (read_lines(), status)
+
+
+    def _map_in_pool(self, function, items, workers=None):
+        """
+            Call function on independent items using a bounded pool of workers
+            Results are sent back in the same order as items
+        """
+        if workers is None:
+            workers = self.module.params.get('read_workers') or self.default_read_workers
+        workers = max(1, min(workers, len(items)))
+        caller = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
+
+        def run(item):
+            self._pool_context.caller = caller
+            # Never let a worker thread exit the module: hand errors back to the main thread
+            try:
+                return (function(item), None)
+            # pylint: disable=broad-except
+            except BaseException as e:
+                return (None, e)
+
+        pool = ThreadPool(workers)
         try:
-            cmd = [self.kops_cmd] + self.kops_args + options + optional_args
-            return self.module.run_command(cmd, data=data)
-        # pylint: disable=broad-except
-        except Exception as e:
-            self.module.fail_json(
-                exception=e,
-                msg="error while launching kops",
-                kops_cmd=self.kops_cmd,
-                kops_args=self.kops_args,
-                kops_options=options,
-                optional_args=optional_args,
-                cmd=cmd
+            outputs = pool.map(run, items)
+        finally:
+            pool.close()
+            pool.join()
+
+        results = []
+        for (output, exception) in outputs:
+            if isinstance(exception, KopsError):
+                self.module_fail_json(**exception.results)
+            if exception is not None:
+                raise exception
+            results.append(output)
+        return results
+
+
+    def get_kops_version(self):
+        """Retrieve kops version as a tuple (None if it can't be detected)"""
+        if self.kops_version is not None:
+            return self.kops_version or None
+
+        cache_dir = self.module.params.get('cache_dir')
+        if cache_dir:
+            version = KopsDiskCache.get_kops_version(cache_dir, self.kops_cmd)
+            if version is not None:
+                self.kops_version = tuple(version)
+                return self.kops_version
+
+        (result, out, _) = self.run_command(["version"])
+        self.kops_version = (parse_kops_version(out) if result == 0 else None) or ()
+        if cache_dir and self.kops_version:
+            KopsDiskCache.set_kops_version(cache_dir, self.kops_cmd, self.kops_version)
+        return self.kops_version or None
+
+
+    def _support_combined_get(self):
+        """Check if kops is able to send back cluster and instance groups in one call"""
+        version = self.get_kops_version()
+        return version is not None and version >= self.combined_get_min_version
+
+
+    def get_wire_format(self):
+        """Format used to exchange objects with kops: json when kops supports it, yaml otherwise"""
+        wire_format = self.module.params.get('wire_format') or 'auto'
+        if wire_format == 'auto':
+            version = self.get_kops_version()
+            if version is not None and version >= self.json_min_version:
+                wire_format = 'json'
+            else:
+                wire_format = 'yaml'
+        return wire_format
+
+
+    def get_planned_commands(self):
+        """kops commands which would have been launched without check mode"""
+        return [" ".join(cmd) for cmd in self.planned_commands]
+
+
+    def get_kops_statistics(self):
+        """kops execution statistics sent back with module results"""
+        return dict(
+            kops_invocations=self.kops_invocations,
+            kops_cached_reads=self.kops_cached_reads,
+            state_store_reads=self.state_store_reads,
+            kops_retries=self.kops_retries,
+            kops_retry_time=round(self.kops_retry_time, 3),
+            kops_rate_limit_wait=round(self.kops_rate_limit_wait, 3),
+        )
+
+
+    def module_exit_json(self, **results):
+        """Send back results to Ansible with kops execution statistics"""
+        self.flush_cluster_updates()
+        if self.module.check_mode:
+            results['planned_commands'] = self.get_planned_commands()
+        results['kops_trace'] = self.kops_trace
+        results.update(self.get_kops_statistics())
+        self.module.exit_json(**results)
+
+
+    def module_fail_json(self, **results):
+        """Send back failure to Ansible with kops execution statistics (retries included)"""
+        for (key, value) in iteritems(self.get_kops_statistics()):
+            results.setdefault(key, value)
+        self.module.fail_json(**results)
+
+
+    def get_spec_changes(self, object_definition, expected_spec):
+        """
+            Send back fields of expected_spec which really differ from object spec
+            None values are ignored and changed paths are recorded in spec_changes
+        """
+        spec_to_update = {}
+        paths = []
+        for (field, value) in iteritems(expected_spec):
+            if value is None:
+                continue
+            changed_paths = get_changed_paths(
+                object_definition['spec'].get(field), value, 'spec.' + field
             )
+            if changed_paths:
+                spec_to_update[field] = value
+                paths += changed_paths
+
+        if paths:
+            self.spec_changes[object_definition['metadata']['name']] = sorted(paths)
+        return spec_to_update
 
 
     def update_object_definition(self, cluster_name, object_definition, spec_to_update):
         """Update object definition (cluster or instance group)"""
-        if not spec_to_update:
+        return self.update_objects_definitions(cluster_name, [(object_definition, spec_to_update)])
+
+
+    def update_objects_definitions(self, cluster_name, objects_updates):
+        """
+            Update several objects definitions (cluster or instance groups) of a cluster
+            objects_updates is a list of (object definition, spec to update)
+            Every changed object is sent to kops using one `kops replace`
+        """
+        objects_updates = [
+            (object_definition, spec_to_update)
+            for (object_definition, spec_to_update) in objects_updates if spec_to_update
+        ]
+        if not objects_updates:
             return False
 
-        new_object_definition = merge_hash(object_definition, {'spec': spec_to_update})
+        new_objects_definitions = []
+        for (object_definition, spec_to_update) in objects_updates:
+            new_object_definition = merge_hash(object_definition, {'spec': spec_to_update})
+            # Remove timestamp metadata in object definition to avoid parsing issue
+            new_object_definition['metadata'] = dict(new_object_definition['metadata'])
+            new_object_definition['metadata'].pop('creationTimestamp', None)
+            new_objects_definitions.append(new_object_definition)
 
         cmd = ["replace", "-f", "-"]
-        # Remove timestamp metadata in object definition to avoid parsing issue
-        del new_object_definition['metadata']['creationTimestamp']
-        (result, _, err) = self.run_command(cmd, data=yaml.dump(new_object_definition))
+        (result, _, err) = self.run_command(
+            cmd,
+            data=dump_all(new_objects_definitions, self.get_wire_format()),
+            cluster_name=cluster_name
+        )
         if result > 0:
-            self.module.fail_json(
-                msg="Error while updating object definition",
+            if len(objects_updates) == 1:
+                self.module_fail_json(
+                    msg="Error while updating object definition",
+                    kops_error=err,
+                    object_definition=objects_updates[0][0],
+                    spec_to_update=objects_updates[0][1],
+                    new_object_definition=new_objects_definitions[0]
+                )
+            self.module_fail_json(
+                msg="Error while updating objects definitions",
                 kops_error=err,
-                object_definition=object_definition,
-                spec_to_update=spec_to_update,
-                new_object_definition=new_object_definition
+                spec_to_update=[spec_to_update for (_, spec_to_update) in objects_updates],
+                new_objects_definitions=new_objects_definitions
             )
-        self._update_cluster_definition(cluster_name)
+        for (object_definition, spec_to_update) in objects_updates:
+            self.add_change_impacts(
+                cluster_name, get_change_impacts(object_definition, spec_to_update)
+            )
+        # Every change staged during the task is applied by one `kops update cluster`
+        if cluster_name not in self.pending_cluster_updates:
+            self.pending_cluster_updates.append(cluster_name)
 
         return True
 
 
+    def add_change_impacts(self, cluster_name, impacts):
+        """Merge impacts of a change made to a cluster (None when impact is unknown)"""
+        with self._lock:
+            if impacts is None or self.change_impacts.get(cluster_name, set()) is None:
+                self.change_impacts[cluster_name] = None
+            else:
+                self.change_impacts.setdefault(cluster_name, set()).update(impacts)
+
+
+    def flush_cluster_updates(self):
+        """Apply changes staged by update_object_definition and not applied yet"""
+        for cluster_name in list(self.pending_cluster_updates):
+            self._update_cluster_definition(cluster_name)
+
+
     def _update_cluster_definition(self, cluster_name):
         """Update cluster definition"""
+        if cluster_name in self.pending_cluster_updates:
+            self.pending_cluster_updates.remove(cluster_name)
         cmd = ["update", "cluster", cluster_name, "--yes"]
+        if self.module.check_mode:
+            # Report changes kops would apply
+            self.planned_commands.append(cmd)
+            cmd = cmd[:-1]
         (result, update_output, update_operations) = self.run_command(cmd)
         if result > 0:
-            self.module.fail_json(
+            self.module_fail_json(
                 msg="Error while updating cluster definition",
                 error=update_operations
             )
         return (update_output, update_operations)
 
 
-    def _is_cluster_need_rolling_update(self, cluster_name):
-        """Check if cluster need rolling update"""
+    def _is_cluster_need_update(self, cluster_name):
+        """Check (without applying anything) if cloud resources differ from cluster definition"""
+        (result, out, err) = self.run_command(["update", "cluster", cluster_name])
+        if result > 0:
+            self.module_fail_json(msg="Error while checking cluster definition", error=err)
+        return "No changes need to be applied" not in out + err
+
+
+    @staticmethod
+    def _get_instance_groups_args(instance_groups):
+        """Limit a rolling update to some instance groups (whole cluster if None)"""
+        args = []
+        for ig_name in instance_groups or []:
+            args += ["--instance-group", ig_name]
+        return args
+
+
+    def _probe_rolling_update(self, cluster_name, instance_groups=None):
+        """Send back output of kops rolling update preview"""
         cmd = ["rolling-update", "cluster", cluster_name, "--cloudonly"]
+        cmd += self._get_instance_groups_args(instance_groups)
         (result, out, err) = self.run_command(cmd)
         if result > 0:
-            self.module.fail_json(msg=err)
-        return "No rolling-update required." not in out
+            self.module_fail_json(msg=err)
+        return out
 
 
-    def _rolling_update(self, cluster_name):
-        """Apply cluster modifications"""
+    def _rolling_update_by_instance_group(self, cluster_name, instance_groups, concurrency):
+        """
+            Roll instance groups with one kops process each: masters first and alone,
+            then node groups concurrently
+        """
+        nodes_definitions = self.get_nodes(cluster_name)
+        masters = [
+            ig_name for ig_name in instance_groups
+            if nodes_definitions.get(ig_name, {}).get('spec', {}).get('role') == 'Master'
+        ]
+        nodes = [ig_name for ig_name in instance_groups if ig_name not in masters]
+
+        rolling_update = KopsRollingUpdate(
+            self, cluster_name, concurrency, cloudonly=self.module.params.get('cloudonly')
+        )
+        results = rolling_update.run(masters, nodes)
+        if results['failed']:
+            self.module_fail_json(
+                msg="Error while rolling instance groups of %s" % cluster_name,
+                rolling_update=results
+            )
+        return results
+
+
+    def _get_instance_groups_to_probe(self, cluster_name, impacts):
+        """Instance groups whose instances may be replaced by changes (None for every one)"""
+        if ROLL_MASTERS in impacts and ROLL_NODES in impacts:
+            return None
+        masters = ROLL_MASTERS in impacts
+        nodes_definitions = self.get_nodes(cluster_name)
+        return [
+            ig_name for (ig_name, ig_definition) in sorted(iteritems(nodes_definitions))
+            if (ig_definition.get('spec', {}).get('role') == 'Master') == masters
+        ] or None
+
+
+    def _get_rolling_update_command(self, cluster_name, instance_groups=None):
         cmd = ["rolling-update", "cluster", cluster_name, "--yes"]
-        if self.module.params['cloudonly']:
+        if self.module.params.get('cloudonly'):
             cmd += ["--cloudonly"]
+        return cmd + self._get_instance_groups_args(instance_groups)
+
+
+    def _start_rolling_update(self, cluster_name, instance_groups, progress_file):
+        """
+            Start rolling update in a detached process writing kops output to progress_file
+            Progress is read back with kops_facts (rolling_update_progress option)
+        """
+        cmd = self._get_rolling_update_command(cluster_name, instance_groups)
+        self._invalidate_read_cache(cluster_name)
+        with self._lock:
+            self.kops_invocations += 1
+        start = time.time()
+        try:
+            cmd = [self.kops_cmd] + self.kops_args + cmd
+            pid = start_detached(cmd, progress_file, cluster_name)
+            # kops is still running: only its launch is traced
+            self.record_trace(cmd, start, None, caller='_start_rolling_update')
+        except RollingUpdateRunning as e:
+            self.module_fail_json(msg=str(e), progress_file=progress_file)
+        except (IOError, OSError) as e:
+            self.module_fail_json(
+                exception=e, msg="Unable to start rolling update", progress_file=progress_file
+            )
+        return dict(status='running', pid=pid, progress_file=progress_file)
+
 
+    def _rolling_update(self, cluster_name, instance_groups=None):
+        """Apply cluster modifications"""
+        cmd = self._get_rolling_update_command(cluster_name, instance_groups)
         (result, out, err) = self.run_command(cmd)
         if result > 0:
-            self.module.fail_json(msg=err)
+            self.module_fail_json(msg=err)
         return (out, err)
 
 
-    def _apply_modifications(self, cluster_name):
-        # Update definition then check if rolling update is needed
-        (update_output, update_operations) = self._update_cluster_definition(cluster_name)
-        changed = self._is_cluster_need_rolling_update(cluster_name)
+    def _apply_modifications(self, cluster_name, instance_groups=None, cluster_definition=None):
+        """
+            Update definition then check if rolling update is needed
+            instance_groups limits rolling update to these instance groups
+            cluster_definition (with instance groups) saves a read when caller already has it
+        """
+        # Instance groups covered by this apply, recorded in journal
+        rolled = instance_groups
+        journal = self._get_journal()
+        if journal is not None:
+            if cluster_definition is None or 'instancegroups' not in cluster_definition:
+                cluster_definition = self.get_clusters(cluster_name)
+            fingerprint = get_spec_fingerprint(cluster_definition, self.get_kops_version())
+            rolled = instance_groups or list(cluster_definition.get('instancegroups', {}))
+            # Nothing changed since last successful apply: cloud is not checked again
+            if (cluster_name not in self.pending_cluster_updates
+                    and not self.module.params.get('force_apply')
+                    and journal.is_applied(cluster_name, fingerprint, rolled)):
+                return {
+                    'changed': False,
+                    'cluster_name': cluster_name,
+                    'update_operations': '',
+                    'update_output': '',
+                    'spec_fingerprint': fingerprint,
+                    'spec_already_applied': True,
+                }
+
+        # Definition unchanged by this task has nothing to apply: kops is only asked for
+        # pending changes when force_apply is set
+        updated = cluster_name in self.pending_cluster_updates or bool(
+            self.module.params.get('force_apply') and self._is_cluster_need_update(cluster_name)
+        )
+        if updated:
+            (update_output, update_operations) = self._update_cluster_definition(cluster_name)
+        else:
+            (update_output, update_operations) = ('', '')
+
+        # Impacts of changes made by this task (None when unknown or nothing changed)
+        impacts = self.change_impacts.pop(cluster_name, None)
+        # Instance groups created in check mode can't be probed: kops doesn't know them
+        created = self.planned_instance_groups.pop(cluster_name, [])
+        if impacts == set([UPDATE_ONLY]):
+            # No instance is replaced by these changes: rolling update is not probed
+            probe_output = "No rolling-update required."
+            rolled = []
+        elif instance_groups is not None and set(instance_groups).issubset(created):
+            probe_output = "No rolling-update required."
+        else:
+            if instance_groups is None and impacts:
+                instance_groups = self._get_instance_groups_to_probe(cluster_name, impacts)
+                if instance_groups is not None:
+                    rolled = instance_groups
+            probe_output = self._probe_rolling_update(cluster_name, [
+                ig_name for ig_name in instance_groups if ig_name not in created
+            ] if instance_groups is not None else None)
+        # Rolling update of instance groups created in check mode is planned
+        changed = "No rolling-update required." not in probe_output or bool(created)
+        if self.module.check_mode and impacts and set([ROLL_MASTERS, ROLL_NODES]) & impacts:
+            # State store is unchanged in check mode: probe can't see instances to be replaced
+            changed = True
         results = {
-            'changed': changed,
+            'changed': updated or changed,
             'cluster_name': cluster_name,
+            'change_impacts': sorted(impacts) if impacts is not None else None,
             'update_operations': update_operations,
             'update_output': update_output,
         }
-        if changed:
-            (out, err) = self._rolling_update(cluster_name)
+        concurrency = self.module.params.get('rolling_update_concurrency')
+        progress_file = self.module.params.get('rolling_update_progress_file')
+        instance_groups_to_roll = parse_rolling_update_status(probe_output)
+        if changed and progress_file and not self.module.check_mode:
+            results['rolling_update_progress'] = self._start_rolling_update(
+                cluster_name, instance_groups, progress_file
+            )
+        elif changed and concurrency and instance_groups_to_roll and not self.module.check_mode:
+            rolling_update = self._rolling_update_by_instance_group(
+                cluster_name, instance_groups_to_roll, concurrency
+            )
+            results['rolling_update'] = rolling_update
+            results['rolling_update_output'] = "".join(
+                r.get('output', '') for r in rolling_update['instance_groups']
+            )
+            results['rolling_update_operations'] = "".join(
+                r.get('operations', '') for r in rolling_update['instance_groups']
+            )
+            # Each instance group has its own kops output
+            events = []
+            for r in rolling_update['instance_groups']:
+                events += parse_rolling_update_output(r.get('operations', ''), cluster_name)
+            results['rolling_update_timings'] = get_rolling_update_timings(events)
+        elif changed:
+            (out, err) = self._rolling_update(cluster_name, instance_groups)
             results['rolling_update_output'] = out
             results['rolling_update_operations'] = err
+            results['rolling_update_timings'] = get_rolling_update_timings(
+                parse_rolling_update_output(err, cluster_name)
+            )
 
+        if journal is not None:
+            results['spec_fingerprint'] = fingerprint
+            results['spec_already_applied'] = False
+            # Detached rolling update may still fail
+            if not self.module.check_mode and 'rolling_update_progress' not in results:
+                journal.record(cluster_name, fingerprint, rolled)
         return results
 
 
-    def get_nodes(self, cluster_name, ig_name=None):
-        """Retrieve instance groups (nodes, master)"""
+    def _get_nodes_command(self, cluster_name, ig_name=None):
+        """kops command used to retrieve instance groups"""
         cmd = ["get", "instancegroups", "--name", cluster_name]
         if ig_name is not None:
             cmd += [ig_name]
+        return cmd + ["-o=" + self.get_wire_format()]
 
-        (result, out, err) = self.run_command(cmd + ["-o=yaml"])
-        if result > 0:
-            self.module.fail_json(msg=err.strip())
 
+    def _parse_nodes(self, out):
+        """Parse instance groups definitions returned by kops"""
         nodes_definitions = {}
-        for istance_group in out.split("---\n"):
-            definition = yaml.load(istance_group)
+        for definition in load_documents(out, self.get_wire_format()):
             name = definition['metadata']['name']
             nodes_definitions[name] = definition
+        return nodes_definitions
+
+
+    def _read_state_store(self, function, *args):
+        """
+            Call a state store reader function
+            Send back (True, result) or (False, None) if kops has to be used instead
+        """
+        try:
+            result = function(*args)
+        except StateStoreError:
+            return (False, None)
+        with self._lock:
+            self.state_store_reads += 1
+        return (True, result)
+
+
+    def get_nodes(self, cluster_name, ig_name=None):
+        """Retrieve instance groups (nodes, master)"""
+        reader = self._get_direct_reader()
+        if reader is not None:
+            (success, nodes_definitions) = self._read_state_store(
+                reader.read_instance_groups, cluster_name
+            )
+            # Unknown instance group is reported by kops
+            if success and (ig_name is None or ig_name in nodes_definitions):
+                if ig_name is not None:
+                    return nodes_definitions[ig_name]
+                return nodes_definitions
+
+        # Instance group can be picked from an already retrieved listing of the cluster
+        cached_result = self._get_cached_read(self._get_nodes_command(cluster_name))
+        if ig_name is not None and cached_result is not None:
+            nodes_definitions = self._parse_nodes(cached_result[1])
+            if ig_name in nodes_definitions:
+                with self._lock:
+                    self.kops_cached_reads += 1
+                return nodes_definitions[ig_name]
+
+        (result, out, err) = self.run_command(self._get_nodes_command(cluster_name, ig_name))
+        if result > 0:
+            self.module_fail_json(msg=err.strip())
+
+        nodes_definitions = self._parse_nodes(out)
 
         if ig_name is not None:
             return nodes_definitions[ig_name]
         return nodes_definitions
 
 
+    def _get_nodes_bulk(self, cluster_names):
+        """Retrieve instance groups of several clusters concurrently"""
+        if self._get_direct_reader() is not None:
+            return dict(zip(cluster_names, self._map_in_pool(self.get_nodes, cluster_names)))
+
+        outputs = self._map_in_pool(
+            self.run_command,
+            [self._get_nodes_command(cluster_name) for cluster_name in cluster_names]
+        )
+
+        nodes_definitions = {}
+        for cluster_name, (result, out, err) in zip(cluster_names, outputs):
+            if result > 0:
+                self.module_fail_json(msg=err.strip())
+            nodes_definitions[cluster_name] = self._parse_nodes(out)
+        return nodes_definitions
+
+
+    def _get_cluster_with_nodes(self, cluster_name, failed_when_not_found=True):
+        """Retrieve one cluster and its instance groups using a single kops call"""
+        wire_format = self.get_wire_format()
+        (result, out, err) = self.run_command(["get", "--name", cluster_name, "-o=" + wire_format])
+        if result > 0:
+            if not failed_when_not_found:
+                return {}
+            self.module_fail_json(msg=err.strip())
+
+        cluster_definition = None
+        nodes_definitions = {}
+        for definition in load_documents(out, wire_format):
+            if definition.get('kind') == 'Cluster':
+                cluster_definition = definition
+            elif definition.get('kind') == 'InstanceGroup':
+                nodes_definitions[definition['metadata']['name']] = definition
+
+        if cluster_definition is None:
+            if not failed_when_not_found:
+                return {}
+            self.module_fail_json(msg="cluster not found \"%s\"" % cluster_name)
+
+        cluster_definition["instancegroups"] = nodes_definitions
+        return cluster_definition
+
+
+    def _get_clusters_from_state_store(self, cluster_name=None, retrieve_ig=True,
+                                       failed_when_not_found=True):
+        """Retrieve defined clusters from state store (None if kops has to be used instead)"""
+        reader = self._get_direct_reader()
+        if reader is None:
+            return None
+
+        if cluster_name is not None:
+            (success, cluster_definition) = self._read_state_store(
+                reader.read_cluster, cluster_name
+            )
+            # Let kops report missing cluster
+            if not success or (cluster_definition is None and failed_when_not_found):
+                return None
+            if cluster_definition is None:
+                return {}
+            clusters_definitions = {cluster_name: cluster_definition}
+        else:
+            (success, clusters_definitions) = self._read_state_store(reader.read_clusters)
+            if not success:
+                return None
+
+        if retrieve_ig:
+            nodes_definitions = self._get_nodes_bulk(list(clusters_definitions))
+            for _cluster_name, cluster_definition in iteritems(clusters_definitions):
+                cluster_definition["instancegroups"] = nodes_definitions[_cluster_name]
+
+        if cluster_name is not None:
+            return clusters_definitions[cluster_name]
+        return clusters_definitions
+
+
+    def _get_full_clusters(self, cmd):
+        """
+            Send back (rc, clusters definitions, stderr) of a fully populated specification read
+            Specification can be huge: comments are removed and documents parsed while kops
+            output is read instead of keeping copies of it. Specification text is only kept
+            when it has to be cached on disk (parsed definitions hold dates JSON can't store).
+        """
+        disk_cache = self._get_disk_cache()
+        cluster_name = self._get_command_cluster_name(cmd)
+        if disk_cache is not None:
+            cached_result = disk_cache.get(cluster_name, cmd)
+            if cached_result is not None:
+                with self._lock:
+                    self.kops_cached_reads += 1
+                (rc, out, err) = cached_result
+                return (rc, self._parse_full_clusters(out.splitlines(True)), err)
+
+        (lines, status) = self.run_command_stream(cmd)
+        kept_lines = [] if disk_cache is not None else None
+        clusters_definitions = self._parse_full_clusters(lines, kept_lines)
+        if kept_lines is not None and status['rc'] == 0:
+            disk_cache.set(cluster_name, cmd, (status['rc'], ''.join(kept_lines), status['err']))
+        return (status['rc'], clusters_definitions, status['err'])
+
+
+    @staticmethod
+    def _parse_full_clusters(lines, kept_lines=None):
+        """Parse clusters definitions with comments removed (kept in kept_lines if given)"""
+        def strip_comment(line):
+            """Remove comment of a line"""
+            line = FULL_SPEC_COMMENT_RE.sub('', line)
+            if kept_lines is not None:
+                kept_lines.append(line)
+            return line
+
+        clusters_definitions = {}
+        for cluster_definition in load_yaml_documents(LineStream(lines, transform=strip_comment)):
+            clusters_definitions[cluster_definition['metadata']['name']] = cluster_definition
+        return clusters_definitions
+
+
     def get_clusters(self, cluster_name=None, retrieve_ig=True,
                      failed_when_not_found=True, full=False):
         """Retrieve defined clusters"""
+        # Fully populated specification is only computed by kops
+        if not full:
+            clusters_definitions = self._get_clusters_from_state_store(
+                cluster_name, retrieve_ig, failed_when_not_found
+            )
+            if clusters_definitions is not None:
+                return clusters_definitions
+
+        if cluster_name is not None and retrieve_ig and not full and self._support_combined_get():
+            return self._get_cluster_with_nodes(cluster_name, failed_when_not_found)
+
         cmd = ["get", "clusters"]
         if cluster_name is not None:
             cmd += ["--name", cluster_name]
         if full:
             cmd += ["--full"]
 
-        (result, out, err) = self.run_command(cmd + ["-o=yaml"])
+        if full:
+            (result, clusters_definitions, err) = self._get_full_clusters(cmd + ["-o=yaml"])
+        else:
+            (result, out, err) = self.run_command(cmd + ["-o=" + self.get_wire_format()])
+            if result == 0:
+                clusters_definitions = {}
+                for cluster_definition in load_documents(out, self.get_wire_format()):
+                    name = cluster_definition['metadata']['name']
+                    clusters_definitions[name] = cluster_definition
+
         if result > 0:
             if not failed_when_not_found and cluster_name is not None:
                 return {}
-            self.module.fail_json(msg=err.strip())
+            self.module_fail_json(msg=err.strip())
 
-        if full:
-            # Clean up returned strings
-            out = re.sub(r'^\s*//.*', '', out, flags=re.M)
+        if retrieve_ig:
+            nodes_definitions = self._get_nodes_bulk(list(clusters_definitions))
+            for _cluster_name, cluster_definition in iteritems(clusters_definitions):
+                cluster_definition["instancegroups"] = nodes_definitions[_cluster_name]
 
-        clusters_definitions = {}
-        for cluster in out.split("---\n"):
-            cluster_definition = yaml.load(cluster)
-            _cluster_name = cluster_definition['metadata']['name']
-            if retrieve_ig:
-                cluster_definition["instancegroups"] = self.get_nodes(_cluster_name)
-            clusters_definitions[_cluster_name] = cluster_definition
         if cluster_name is not None:
             return clusters_definitions[cluster_name]
         return clusters_definitions
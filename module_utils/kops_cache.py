@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Persistent cache of kops reads shared by Kops Ansible modules runs"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from ansible.module_utils.kops_files import read_json, write_json
+from ansible.module_utils.kops_state_store import StateStoreError
+
+
+def get_hash(*values):
+    """Send back a stable hash of values"""
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class KopsDiskCache():
+    """
+        Store kops reads on disk, keyed by state store, cluster name and kops version
+
+        Layout: <cache_dir>/<state store hash>/clusters/<cluster name>/<command hash>.json
+        Cluster listings are stored in <cache_dir>/<state store hash>/listing
+    """
+
+    def __init__(self, cache_dir, state_store, kops_version, ttl, state_store_reader=None):
+        self.cache_dir = cache_dir
+        self.state_store = state_store
+        self.kops_version = kops_version
+        self.ttl = ttl
+        self.state_store_reader = state_store_reader
+        self.store_dir = os.path.join(cache_dir, get_hash(state_store))
+
+
+    @staticmethod
+    def get_kops_version(cache_dir, kops_cmd):
+        """Send back kops version stored for this kops binary (None if unknown)"""
+        path = KopsDiskCache._kops_version_path(cache_dir, kops_cmd)
+        entry = read_json(path) if path is not None else None
+        if entry is None:
+            return None
+        return entry.get('version')
+
+
+    @staticmethod
+    def set_kops_version(cache_dir, kops_cmd, version):
+        """Store kops version of this kops binary"""
+        path = KopsDiskCache._kops_version_path(cache_dir, kops_cmd)
+        if path is not None:
+            write_json(path, {'version': version})
+
+
+    @staticmethod
+    def _kops_version_path(cache_dir, kops_cmd):
+        """kops version is keyed by kops binary path, size and modification time"""
+        try:
+            stat = os.stat(kops_cmd)
+        except OSError:
+            return None
+        return os.path.join(
+            cache_dir, 'kops-version-' + get_hash(kops_cmd, stat.st_size, stat.st_mtime) + '.json'
+        )
+
+
+    def _get_cluster_dir(self, cluster_name):
+        if cluster_name is None:
+            return os.path.join(self.store_dir, 'listing')
+        return os.path.join(self.store_dir, 'clusters', cluster_name)
+
+
+    def _get_entry_path(self, cluster_name, options):
+        return os.path.join(
+            self._get_cluster_dir(cluster_name),
+            get_hash(self.kops_version, list(options)) + '.json'
+        )
+
+
+    def get_fingerprint(self, cluster_name):
+        """Cheap fingerprint of state store objects (None when state store can't be checked)"""
+        if self.state_store_reader is None:
+            return None
+        try:
+            return self.state_store_reader.get_fingerprint(cluster_name)
+        except StateStoreError:
+            return None
+
+
+    def get(self, cluster_name, options):
+        """Send back cached result of a kops read (None if missing, expired or stale)"""
+        entry = read_json(self._get_entry_path(cluster_name, options))
+        if entry is None:
+            return None
+        if time.time() - entry['time'] > self.ttl:
+            return None
+        if entry['fingerprint'] != self.get_fingerprint(cluster_name):
+            return None
+        return tuple(entry['result'])
+
+
+    def set(self, cluster_name, options, result):
+        """Store result of a kops read"""
+        write_json(
+            self._get_entry_path(cluster_name, options),
+            {
+                'time': time.time(),
+                'fingerprint': self.get_fingerprint(cluster_name),
+                'result': list(result),
+            }
+        )
+
+
+    def invalidate(self, cluster_name=None):
+        """Drop cached reads of a cluster and cluster listings (everything if cluster is unknown)"""
+        if cluster_name is None:
+            paths = [self.store_dir]
+        else:
+            paths = [self._get_cluster_dir(cluster_name), self._get_cluster_dir(None)]
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
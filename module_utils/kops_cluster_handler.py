@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Bring a kops cluster to its expected state (shared by kops_cluster and kops_fleet)"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.kops import Kops, to_camel_case
+from ansible.module_utils.six import string_types
+
+
+class KopsClusterHandler(Kops):
+    """Handle state for kops cluster"""
+
+    SPECIAL_CASE = {
+        "admin_access": {
+            "field": "kubernetesApiAccess",
+            "transform": "list"
+        },
+        "ssh_access": {
+            "transform": "list"
+        }
+    }
+
+    def delete_cluster(self, cluster_name):
+        """Delete cluster"""
+        (result, out, err) = self.run_command(
+            ["delete", "cluster", "--yes", "--name", cluster_name]
+        )
+        if result > 0:
+            self.module_fail_json(msg=err)
+        return dict(
+            changed=True,
+            kops_output=out,
+            cluster_name=cluster_name,
+        )
+
+
+    def create_cluster(self, cluster_name):
+        """Create cluster using kops"""
+        cmd = ["create", "cluster", "--name", cluster_name]
+
+        if self.module.params['state'] in ['updated', 'started']:
+            cmd.append("--yes")
+
+        (result, out, err) = self.run_command(cmd, add_optional_args_from_tag="create")
+        if result > 0:
+            self.module_fail_json(msg=err)
+
+        # Handle docker definition (version, options)
+        # In check mode, cluster is not created and its definition can't be read
+        if not self.module.check_mode:
+            self.update_cluster(cluster_name)
+
+        return dict(
+            changed=True,
+            cluster_name=cluster_name,
+            kops_output=out
+        )
+
+
+    def get_spec_name(self, param):
+        """
+          Send back variable name as expected in spec field from param name
+          Handle corner case like Cidr/CIDR or special case
+        """
+        if param in self.SPECIAL_CASE and self.SPECIAL_CASE[param].get('field'):
+            return self.SPECIAL_CASE[param]['field']
+
+        return to_camel_case(param).replace('Cidr', 'CIDR')
+
+    def convert_value(self, param, value):
+        """Do some transformation from string to list using SPECIAL_CASE values"""
+        if param in self.SPECIAL_CASE and isinstance(value, string_types):
+            if self.SPECIAL_CASE[param]['transform'] == 'list':
+                return [x.strip() for x in value.split(",")]
+        # If not a special case, send unchanged value
+        return value
+
+    def update_cluster(self, cluster_name, cluster_definition=None):
+        """Update cluster (only fields which really differ are sent to kops)"""
+        if cluster_definition is None:
+            cluster_definition = self.get_clusters(cluster_name, retrieve_ig=False)
+        # Instance groups are not part of cluster object
+        cluster_definition = dict(
+            (key, value) for (key, value) in cluster_definition.items() if key != 'instancegroups'
+        )
+
+        expected_spec = {}
+        cluster_parameters = [
+            'kubernetes_version', 'master_public_name', 'network_cidr',
+            'admin_access', 'ssh_access', 'docker', 'additional_policies',
+        ]
+        for param in cluster_parameters:
+            value = self.module.params[param]
+            if value is not None:
+                expected_spec[self.get_spec_name(param)] = self.convert_value(param, value)
+
+        spec_to_merge = self.get_spec_changes(cluster_definition, expected_spec)
+        return self.update_object_definition(cluster_name, cluster_definition, spec_to_merge)
+
+
+    def apply_present(self, cluster_name, defined_cluster):
+        """Create cluster if does not exist"""
+        if defined_cluster:
+            changed = self.update_cluster(cluster_name, defined_cluster)
+            if self.module.params['state'] in ['updated', 'started']:
+                # Definition read before is still the current one when nothing changed
+                return self._apply_modifications(
+                    cluster_name, cluster_definition=None if changed else defined_cluster
+                )
+            if changed:
+                defined_cluster = self.get_clusters(cluster_name)
+            return dict(
+                changed=changed,
+                cluster_name=cluster_name,
+                defined_cluster=defined_cluster
+            )
+        return self.create_cluster(cluster_name)
+
+
+    def apply_absent(self, cluster_name, cluster_exist):
+        """Delete cluster if cluster exist"""
+        if not cluster_exist:
+            return dict(
+                changed=False,
+                cluster_name=cluster_name,
+            )
+        return self.delete_cluster(cluster_name)
+
+
+    def check_cluster_state(self):
+        """Check cluster state and apply expected state"""
+        cluster_name = self.module.params['name']
+        state = self.module.params['state']
+        # Instance groups are needed to check if an update has already been applied
+        defined_cluster = self.get_clusters(
+            cluster_name=cluster_name,
+            retrieve_ig=state == 'updated' and self.module.params.get('journal_dir') is not None,
+            failed_when_not_found=False
+        )
+
+        if state in ['present', 'updated']:
+            return self.apply_present(cluster_name, defined_cluster)
+
+        if state == 'absent':
+            return self.apply_absent(cluster_name, defined_cluster)
+
+        self.module_fail_json(msg="Operation not supported", defined_cluster=defined_cluster)
+        return None
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Compare expected and current kops specs regardless of how values are typed"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import re
+
+from ansible.module_utils.six import iteritems, string_types, text_type
+
+CIDR_RE = re.compile(r'^[0-9a-fA-F:.]+/[0-9]+$')
+
+
+def normalize(value):
+    """
+        Send back a comparable form of a spec value:
+          - numbers and booleans are compared as text (module parameters are often strings)
+          - strings holding a JSON document (eg: additional policies) are compared parsed
+          - CIDR lists are compared regardless of their order
+    """
+    if isinstance(value, dict):
+        return dict((text_type(k), normalize(v)) for (k, v) in iteritems(value))
+    if isinstance(value, (list, tuple)):
+        items = [normalize(v) for v in value]
+        if items and all(isinstance(i, string_types) and CIDR_RE.match(i) for i in items):
+            return sorted(items)
+        return items
+    if isinstance(value, bool):
+        return text_type(value).lower()
+    if isinstance(value, (int, float)):
+        return text_type(value)
+    if isinstance(value, string_types):
+        value = value.strip()
+        if value[:1] in ('{', '['):
+            try:
+                return normalize(json.loads(value))
+            except ValueError:
+                pass
+        if value.lower() in ('true', 'false'):
+            return value.lower()
+    return value
+
+
+def get_changed_paths(current, expected, path='spec'):
+    """
+        Send back paths of expected values that differ from current ones
+        Keys missing from an expected dict are left untouched by kops replace: they are not compared
+    """
+    if isinstance(expected, dict) and isinstance(current, dict):
+        paths = []
+        for key in sorted(expected):
+            paths += get_changed_paths(current.get(key), expected[key], path + '.' + key)
+        return paths
+    if normalize(current) != normalize(expected):
+        return [path]
+    return []
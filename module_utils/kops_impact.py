@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Impact of kops spec fields changes on cloud resources"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+# `kops update cluster` is enough (eg: security groups, autoscaling groups bounds)
+UPDATE_ONLY = 'update-only'
+# Instances have to be replaced
+ROLL_MASTERS = 'roll-masters'
+ROLL_NODES = 'roll-nodes'
+
+# Cluster spec fields missing from this table have an unknown impact
+CLUSTER_FIELDS_IMPACT = {
+    'kubernetesApiAccess': (UPDATE_ONLY,),
+    'sshAccess': (UPDATE_ONLY,),
+    'additionalPolicies': (UPDATE_ONLY,),
+    'kubernetesVersion': (ROLL_MASTERS, ROLL_NODES),
+    'docker': (ROLL_MASTERS, ROLL_NODES),
+    'kubeAPIServer': (ROLL_MASTERS,),
+    'kubeControllerManager': (ROLL_MASTERS,),
+    'kubeScheduler': (ROLL_MASTERS,),
+    'etcdClusters': (ROLL_MASTERS,),
+    'masterKubelet': (ROLL_MASTERS,),
+    'kubelet': (ROLL_NODES,),
+}
+
+# Other instance group spec fields change instances of the group (roll-masters or roll-nodes)
+INSTANCE_GROUP_FIELDS_IMPACT = {
+    'minSize': (UPDATE_ONLY,),
+    'maxSize': (UPDATE_ONLY,),
+}
+
+
+def get_change_impacts(object_definition, fields):
+    """
+        Send back impacts of changed spec fields of a kops object (cluster or instance group)
+        None is sent back when the impact of one field is unknown
+    """
+    if object_definition.get('kind') == 'InstanceGroup':
+        table = INSTANCE_GROUP_FIELDS_IMPACT
+        role = object_definition.get('spec', {}).get('role')
+        default = (ROLL_MASTERS,) if role == 'Master' else (ROLL_NODES,)
+    else:
+        table = CLUSTER_FIELDS_IMPACT
+        default = None
+
+    impacts = set()
+    for field in fields:
+        field_impacts = table.get(field, default)
+        if field_impacts is None:
+            return None
+        impacts.update(field_impacts)
+    return impacts
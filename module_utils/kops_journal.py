@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Local journal of cluster specifications successfully applied to the cloud"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import shutil
+import time
+
+from ansible.module_utils.kops_cache import get_hash
+from ansible.module_utils.kops_files import read_json, write_json
+
+
+def get_spec_fingerprint(cluster_definition, kops_version=None):
+    """
+        Canonical hash of cluster and instance groups specifications
+        kops version is part of it as a new kops release may change cloud resources
+    """
+    return get_hash(
+        kops_version,
+        cluster_definition.get('spec', {}),
+        dict(
+            (ig_name, ig_definition.get('spec', {}))
+            for (ig_name, ig_definition) in cluster_definition.get('instancegroups', {}).items()
+        )
+    )
+
+
+class KopsJournal():
+    """
+        Remember which specification has been applied to a cluster (and which
+        instance groups have been rolled since) so that unchanged clusters are
+        not updated nor probed again
+
+        Layout: <journal_dir>/<state store hash>/<cluster name>.json
+    """
+
+    def __init__(self, journal_dir, state_store):
+        self.store_dir = os.path.join(journal_dir, get_hash(state_store))
+
+
+    def _get_entry_path(self, cluster_name):
+        return os.path.join(self.store_dir, cluster_name + '.json')
+
+
+    def get(self, cluster_name):
+        """Send back journal entry of a cluster (None if unknown)"""
+        return read_json(self._get_entry_path(cluster_name))
+
+
+    def is_applied(self, cluster_name, fingerprint, instance_groups):
+        """Check if fingerprint has been applied and instance_groups rolled with it"""
+        entry = self.get(cluster_name)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return set(instance_groups).issubset(entry['instance_groups'])
+
+
+    def record(self, cluster_name, fingerprint, instance_groups):
+        """Record a successful apply (groups already rolled with this fingerprint are kept)"""
+        entry = self.get(cluster_name)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            instance_groups = set(instance_groups).union(entry['instance_groups'])
+        write_json(self._get_entry_path(cluster_name), dict(
+            fingerprint=fingerprint,
+            instance_groups=sorted(instance_groups),
+            applied=time.time(),
+        ))
+
+
+    def forget(self, cluster_name=None):
+        """Drop entry of a cluster (every entry if cluster is unknown)"""
+        if cluster_name is None:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            return
+        try:
+            os.remove(self._get_entry_path(cluster_name))
+        except OSError:
+            pass
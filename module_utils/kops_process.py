@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Launch kops processes in their own process group and stop them on timeout"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from ansible.module_utils.six import PY3
+from ansible.module_utils._text import to_bytes, to_text
+
+# Seconds given to kops to exit after SIGTERM before it is killed
+KILL_TIMEOUT = 10
+
+
+def start_process(cmd, **popen_options):
+    """Launch cmd in a new process group so that every process it starts can be stopped"""
+    if PY3:
+        # Unlike preexec_fn, safe when threads are running (pool workers)
+        return subprocess.Popen(cmd, start_new_session=True, **popen_options)
+    return subprocess.Popen(cmd, preexec_fn=os.setsid, **popen_options)
+
+
+def _signal_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        pass
+
+
+def terminate_process_group(process, kill_timeout=KILL_TIMEOUT):
+    """Stop process group gracefully, kill it if it doesn't exit in time"""
+    _signal_group(process, signal.SIGTERM)
+    deadline = time.time() + kill_timeout
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    if process.poll() is None:
+        _signal_group(process, signal.SIGKILL)
+        process.wait()
+
+
+def start_timer(process, timeout, kill_timeout=KILL_TIMEOUT):
+    """
+        Stop process group once timeout (seconds) is over
+        Send back (timer, event set on timeout), timer is None without timeout
+    """
+    timed_out = threading.Event()
+    if timeout is None:
+        return (None, timed_out)
+
+    def stop():
+        timed_out.set()
+        terminate_process_group(process, kill_timeout)
+
+    timer = threading.Timer(max(timeout, 0), stop)
+    timer.daemon = True
+    timer.start()
+    return (timer, timed_out)
+
+
+def run_process(cmd, data=None, timeout=None):
+    """Run cmd and send back (rc, stdout, stderr, timed out)"""
+    process = start_process(
+        cmd,
+        stdin=subprocess.PIPE if data is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    (timer, timed_out) = start_timer(process, timeout)
+    try:
+        (out, err) = process.communicate(to_bytes(data) if data is not None else None)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    return (process.returncode, to_text(out), to_text(err), timed_out.is_set())
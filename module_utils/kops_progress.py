@@ -0,0 +1,333 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Follow kops rolling updates: detached launch, progress file and events parsing"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import datetime
+import fcntl
+import os
+import re
+import subprocess
+import time
+
+from ansible.module_utils._text import to_text
+from ansible.module_utils.kops_files import read_json, write_json
+
+# glog prefix of kops logs: I1203 10:00:00.000000    1 instancegroups.go:165] message
+GLOG_RE = re.compile(r'^[IWEF](\d\d)(\d\d) (\d\d):(\d\d):(\d\d)\.(\d+)\s+\d+ [^\]]+\] (.*)$')
+
+# Seconds given to a detached process to record kops pid
+PID_TIMEOUT = 10
+
+
+class RollingUpdateRunning(Exception):
+    """Raised when a rolling update recorded in a progress file is still running"""
+
+
+EVENTS_RE = [
+    ('draining', re.compile(r'Draining the node: "(?P<node>[^"]+)"')),
+    ('drained', re.compile(r'for pods to stabilize after draining')),
+    ('terminating', re.compile(
+        r'Stopping instance "(?P<instance>[^"]+)"(, node "(?P<node>[^"]+)")?, '
+        r'in group "(?P<instance_group>[^"]+)"'
+    )),
+    ('validating', re.compile(r'Validating the cluster')),
+    ('validated', re.compile(r'Cluster validated')),
+    ('not_validated', re.compile(r'Cluster did not (validate|pass validation)')),
+    ('completed', re.compile(r'Rolling update completed')),
+]
+
+
+def parse_glog_time(month, day, hour, minute, second, fraction):
+    """glog timestamps have no year: current year is used"""
+    return datetime.datetime(
+        datetime.datetime.now().year, int(month), int(day), int(hour), int(minute), int(second),
+        int(fraction[:6].ljust(6, '0'))
+    )
+
+
+class RollingUpdateProgress():
+    """
+        Parse kops rolling update logs line by line into events
+        (draining, drained, terminating, validating, validated, not_validated, completed)
+        Parser state can be saved and restored to go on parsing a growing log.
+    """
+
+    def __init__(self, cluster_name, state=None):
+        self.cluster_name = cluster_name
+        state = state or {}
+        self.events = state.get('events', [])
+        self.node = state.get('node')
+        self.instance_group = state.get('instance_group')
+
+
+    def get_state(self):
+        """Parser state (JSON serializable)"""
+        return dict(events=self.events, node=self.node, instance_group=self.instance_group)
+
+
+    def _get_instance_group_name(self, group):
+        """kops names groups <instance group>.<cluster name>"""
+        suffix = '.' + self.cluster_name
+        if group.endswith(suffix):
+            return group[:-len(suffix)]
+        return group
+
+
+    def feed(self, line):
+        """Parse one line of kops logs, send back the new event (None if line is not an event)"""
+        match = GLOG_RE.match(line.strip())
+        if match is None:
+            return None
+        message = match.group(7)
+
+        for (name, regexp) in EVENTS_RE:
+            event_match = regexp.search(message)
+            if event_match is None:
+                continue
+            fields = event_match.groupdict()
+            if fields.get('instance_group'):
+                self.instance_group = self._get_instance_group_name(fields['instance_group'])
+                if fields.get('node'):
+                    # Node group is only known once its instance is stopped
+                    for event in self.events:
+                        if event['node'] == fields['node'] and event['instance_group'] is None:
+                            event['instance_group'] = self.instance_group
+            if fields.get('node'):
+                self.node = fields['node']
+            elif name == 'terminating':
+                self.node = None
+
+            event = dict(
+                event=name,
+                time=parse_glog_time(*match.groups()[:6]).isoformat(),
+                node=self.node if name in ['draining', 'drained', 'terminating'] else None,
+                instance_group=(
+                    None if name in ['draining', 'drained', 'completed'] else self.instance_group
+                ),
+                instance=fields.get('instance'),
+            )
+            self.events.append(event)
+            return event
+        return None
+
+
+def parse_rolling_update_output(output, cluster_name):
+    """Send back events of a complete kops rolling update output"""
+    parser = RollingUpdateProgress(cluster_name)
+    for line in output.splitlines():
+        parser.feed(line)
+    return parser.events
+
+
+def _parse_event_time(event):
+    for time_format in ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']:
+        try:
+            return datetime.datetime.strptime(event['time'], time_format)
+        except ValueError:
+            pass
+    return None
+
+
+def _get_seconds(start, end):
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds(), 3)
+
+
+def get_rolling_update_timings(events):
+    """
+        Send back time spent (in seconds) on each node and instance group:
+          - drain: from node draining to end of pods stabilization
+          - terminate: from instance stop to cluster validation start
+          - validation: until cluster is validated
+        Unknown values (step skipped or not finished) are None.
+    """
+    nodes = []
+    nodes_by_name = {}
+    instance_groups = {}
+    current = None
+    for event in events:
+        event_time = _parse_event_time(event)
+        name = event['node'] or event['instance']
+        if name is not None:
+            if name not in nodes_by_name:
+                nodes_by_name[name] = dict(
+                    node=event['node'], instance=None, instance_group=None,
+                    drain=None, terminate=None, validation=None,
+                    _started=event_time, _steps={},
+                )
+                nodes.append(nodes_by_name[name])
+            current = nodes_by_name[name]
+
+        if current is not None:
+            current['instance'] = current['instance'] or event['instance']
+            current['instance_group'] = current['instance_group'] or event['instance_group']
+            steps = current['_steps']
+            steps.setdefault(event['event'], event_time)
+            if event['event'] == 'drained':
+                current['drain'] = _get_seconds(steps.get('draining'), event_time)
+            elif event['event'] == 'validating' and 'terminating' in steps:
+                current['terminate'] = _get_seconds(steps['terminating'], steps['validating'])
+            elif event['event'] == 'validated':
+                current['validation'] = _get_seconds(steps.get('validating'), event_time)
+                current = None
+
+        if event['instance_group'] is not None and event_time is not None:
+            group = instance_groups.setdefault(
+                event['instance_group'], dict(_started=event_time, _finished=event_time)
+            )
+            group['_started'] = min(group['_started'], event_time)
+            group['_finished'] = max(group['_finished'], event_time)
+
+    # Node groups are only known once node instance is stopped
+    for node in nodes:
+        group = instance_groups.get(node['instance_group'])
+        if group is not None and node['_started'] is not None:
+            group['_started'] = min(group['_started'], node['_started'])
+
+    return dict(
+        nodes=[
+            dict(
+                (k, v) for (k, v) in node.items() if not k.startswith('_')
+            ) for node in nodes
+        ],
+        instance_groups=dict(
+            (name, dict(
+                duration=_get_seconds(group['_started'], group['_finished']),
+                nodes=len([node for node in nodes if node['instance_group'] == name]),
+            )) for (name, group) in instance_groups.items()
+        ),
+    )
+
+
+def start_detached(cmd, progress_file, cluster_name):
+    """
+        Launch cmd in a detached process writing its output to progress_file
+        Exit code is written in <progress_file>.status once cmd exits
+        Send back pid of the detached process
+    """
+    status_file = progress_file + '.status'
+    status = dict(cmd=cmd, cluster_name=cluster_name, started=time.time(), finished=None, rc=None)
+    # Concurrent tasks using the same progress file never start two rolling updates
+    with open(progress_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        previous = read_json(status_file)
+        if previous is not None and _is_status_running(previous):
+            raise RollingUpdateRunning(
+                "Rolling update of %s recorded in %s is still running (pid %s)"
+                % (previous.get('cluster_name'), progress_file, previous.get('pid'))
+            )
+        for path in [progress_file, progress_file + '.events']:
+            if os.path.exists(path):
+                os.remove(path)
+        write_json(status_file, status)
+
+    pid = os.fork()
+    if pid > 0:
+        # Reap intermediate child, detached one is adopted by init
+        os.waitpid(pid, 0)
+        return _wait_for_pid(status_file)
+
+    # pylint: disable=broad-except
+    try:
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        # Ansible waits for module outputs to be closed
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in [0, 1, 2]:
+            os.dup2(devnull, fd)
+        with open(progress_file, 'ab') as output:
+            process = subprocess.Popen(cmd, stdout=output, stderr=subprocess.STDOUT)
+            write_json(status_file, dict(status, pid=process.pid))
+            status['rc'] = process.wait()
+        status['finished'] = time.time()
+        write_json(status_file, dict(status, pid=process.pid))
+    except BaseException:
+        status['rc'] = -1
+        status['finished'] = time.time()
+        write_json(status_file, status)
+    finally:
+        os._exit(0)
+
+
+def _wait_for_pid(status_file, timeout=PID_TIMEOUT):
+    """Wait for detached process to record kops pid"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = read_json(status_file) or {}
+        if status.get('pid') is not None or status.get('rc') is not None:
+            return status.get('pid')
+        time.sleep(0.05)
+    return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _is_status_running(status):
+    """Check if process recorded in status is still running (or about to record its pid)"""
+    if status.get('rc') is not None:
+        return False
+    if status.get('pid') is None:
+        return time.time() - status.get('started', 0) < PID_TIMEOUT
+    return _is_running(status['pid'])
+
+
+def read_progress(progress_file):
+    """
+        Send back progress of a detached rolling update: status (running, succeeded,
+        failed or lost), exit code and events parsed from kops output
+        Only output written since previous call is parsed.
+    """
+    status = read_json(progress_file + '.status')
+    if status is None:
+        return None
+
+    saved = read_json(progress_file + '.events') or {}
+    parser = RollingUpdateProgress(status['cluster_name'], saved.get('parser'))
+    offset = saved.get('offset', 0)
+    try:
+        with open(progress_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # Last line is parsed once complete
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                parser.feed(to_text(line))
+    except (IOError, OSError):
+        pass
+    write_json(progress_file + '.events', dict(offset=offset, parser=parser.get_state()))
+
+    if status['rc'] is not None:
+        state = 'succeeded' if status['rc'] == 0 else 'failed'
+    elif status.get('pid') is not None and _is_running(status['pid']):
+        state = 'running'
+    else:
+        state = 'lost'
+
+    return dict(
+        status=state,
+        rc=status['rc'],
+        cluster_name=status['cluster_name'],
+        started=status['started'],
+        finished=status['finished'],
+        events=parser.events,
+        timings=get_rolling_update_timings(parser.events),
+        instance_group=parser.instance_group,
+        node=parser.node,
+    )
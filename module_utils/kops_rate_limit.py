@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Token bucket shared by kops processes launched on this host against a state store or account"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import fcntl
+import json
+import os
+import time
+
+from ansible.module_utils.kops_cache import get_hash
+
+
+class KopsRateLimiter():
+    """
+        Token bucket stored in a file locked with flock so that Ansible forks,
+        pool workers and concurrent playbooks share the same rate
+
+        Callers reserve a token (even one not refilled yet) and sleep outside
+        the lock until it is available: kops processes are started in order,
+        at the configured rate, without polling the bucket.
+
+        Layout: <rate_limit_dir>/<key hash>.json
+    """
+
+    def __init__(self, rate_limit_dir, key, rate, burst=1):
+        self.path = os.path.join(rate_limit_dir, get_hash(key) + '.json')
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        try:
+            os.makedirs(rate_limit_dir)
+        except OSError:
+            if not os.path.isdir(rate_limit_dir):
+                raise
+
+
+    def _reserve(self, deadline=None):
+        """Take a token and send back seconds to wait for it (None if deadline would be missed)"""
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    bucket = json.loads(f.read())
+                except ValueError:
+                    bucket = dict(tokens=self.burst, updated=0)
+                now = time.time()
+                tokens = min(
+                    self.burst,
+                    bucket['tokens'] + max(0, now - bucket['updated']) * self.rate
+                ) - 1
+                # Negative tokens are reservations of processes waiting for their turn
+                wait = max(0, -tokens / self.rate)
+                if deadline is not None and now + wait >= deadline:
+                    return None
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(dict(tokens=tokens, updated=now)))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def acquire(self, deadline=None):
+        """Wait for a token, send back seconds waited (None if it can't be given before deadline)"""
+        wait = self._reserve(deadline)
+        if wait:
+            time.sleep(wait)
+        return wait
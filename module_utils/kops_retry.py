@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Classify kops errors and compute delays between retries"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import random
+import re
+
+RETRYABLE = 'retryable'
+FATAL = 'fatal'
+UNKNOWN = 'unknown'
+
+# Throttling and transient errors of S3 state store and cloud APIs
+RETRYABLE_ERRORS_RE = re.compile(
+    r'SlowDown|Throttl|RequestLimitExceeded|TooManyRequests|Rate exceeded|RequestTimeout'
+    r'|ServiceUnavailable|InternalError|connection reset by peer|TLS handshake timeout'
+    r'|i/o timeout|EOF$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Errors which won't go away by themselves: never retried even if a transient error is reported too
+FATAL_ERRORS_RE = re.compile(
+    r'AccessDenied|UnauthorizedOperation|InvalidClientTokenId|SignatureDoesNotMatch'
+    r'|ExpiredToken|NoSuchBucket|NoCredentialProviders|already exists|not found',
+    re.IGNORECASE
+)
+
+
+def classify_error(err):
+    """Send back class of a kops error output: retryable, fatal or unknown"""
+    if FATAL_ERRORS_RE.search(err):
+        return FATAL
+    if RETRYABLE_ERRORS_RE.search(err):
+        return RETRYABLE
+    return UNKNOWN
+
+
+def get_backoff(attempt, delay, max_delay=60):
+    """Exponential backoff with full jitter: random delay up to min(max_delay, delay * 2^attempt)"""
+    return random.uniform(0, min(max_delay, delay * 2 ** attempt))
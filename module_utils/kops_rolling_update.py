@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Roll instance groups of a cluster with one kops process per instance group"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils._text import to_text
+from ansible.module_utils.kops_process import terminate_process_group
+
+
+def parse_rolling_update_status(output):
+    """
+        Send back names of instance groups reported as NeedsUpdate by a rolling update probe
+        Output looks like:
+          NAME               STATUS       NEEDUPDATE  READY  MIN  MAX  NODES
+          master-us-east-1a  NeedsUpdate  1           0      1    1    1
+    """
+    instance_groups = []
+    header_found = False
+    for line in output.splitlines():
+        fields = line.split()
+        if fields[:2] == ['NAME', 'STATUS']:
+            header_found = True
+            continue
+        if header_found and len(fields) >= 2 and fields[1] == 'NeedsUpdate':
+            instance_groups.append(fields[0])
+    return instance_groups
+
+
+class KopsRollingUpdate():
+    """
+        Roll instance groups of a cluster: masters first, one at a time, then
+        node groups concurrently (at most concurrency at the same time)
+        First failure (or timeout) stops every running kops process and cancels
+        instance groups not started yet.
+    """
+
+    poll_interval = 0.2
+    kill_timeout = 10
+
+    def __init__(self, kops, cluster_name, concurrency, cloudonly=False):
+        self.kops = kops
+        self.cluster_name = cluster_name
+        self.concurrency = max(1, concurrency)
+        self.cloudonly = cloudonly
+        self.stopped = threading.Event()
+
+
+    def get_command(self, ig_name):
+        """kops command rolling one instance group"""
+        cmd = ["rolling-update", "cluster", self.cluster_name, "--yes", "--instance-group", ig_name]
+        if self.cloudonly:
+            cmd += ["--cloudonly"]
+        return cmd
+
+
+    def _terminate(self, process):
+        """Stop kops gracefully, kill it if it doesn't exit in time"""
+        terminate_process_group(process, self.kill_timeout)
+
+
+    def roll(self, ig_name):
+        """Roll one instance group (skipped once the rolling update is stopped)"""
+        result = dict(name=ig_name, status='cancelled', duration=0)
+        if self.stopped.is_set():
+            return result
+
+        start = time.time()
+        timeout = self.kops.get_command_timeout(self.get_command(ig_name))
+        if timeout == 0:
+            # Task deadline reached
+            self.stopped.set()
+            result['status'] = 'timed_out'
+            return result
+        # Outputs go to files so that kops never blocks on a full pipe
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        try:
+            try:
+                process = self.kops.start_command(
+                    self.get_command(ig_name), stdout=stdout, stderr=stderr
+                )
+            except OSError as e:
+                self.stopped.set()
+                result.update(status='failed', rc=None, output='', operations=to_text(e))
+                return result
+
+            terminated = timed_out = False
+            while process.poll() is None:
+                if self.stopped.wait(self.poll_interval) and not terminated:
+                    self._terminate(process)
+                    terminated = True
+                elif timeout is not None and time.time() - start > timeout and not terminated:
+                    self._terminate(process)
+                    terminated = timed_out = True
+
+            stdout.seek(0)
+            stderr.seek(0)
+            (output, operations) = (stdout.read(), stderr.read())
+            result.update(
+                rc=process.returncode,
+                output=to_text(output),
+                operations=to_text(operations),
+            )
+            self.kops.record_trace(
+                [self.kops.kops_cmd] + self.kops.kops_args + self.get_command(ig_name), start,
+                process.returncode, len(output), len(operations),
+                caller='_rolling_update_by_instance_group'
+            )
+        finally:
+            stdout.close()
+            stderr.close()
+
+        if result['rc'] == 0:
+            result['status'] = 'done'
+        elif timed_out:
+            result['status'] = 'timed_out'
+            self.stopped.set()
+        elif terminated:
+            result['status'] = 'stopped'
+        else:
+            result['status'] = 'failed'
+            self.stopped.set()
+        result['duration'] = round(time.time() - start, 3)
+        return result
+
+
+    def run(self, masters, nodes):
+        """
+            Roll masters then node groups
+            Send back results of every instance group in rolling order
+        """
+        start = time.time()
+        results = [self.roll(ig_name) for ig_name in masters]
+
+        if nodes:
+            pool = ThreadPool(min(self.concurrency, len(nodes)))
+            try:
+                results += pool.map(self.roll, nodes, 1)
+            finally:
+                pool.close()
+                pool.join()
+
+        return dict(
+            failed=any(r['status'] in ['failed', 'timed_out'] for r in results),
+            duration=round(time.time() - start, 3),
+            instance_groups=results,
+        )
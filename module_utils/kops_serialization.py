@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Parse and serialize kops objects for Kops Ansible modules"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import datetime
+import json
+import re
+
+import yaml
+
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE_RE = re.compile(r'\s*')
+
+# Use libyaml bindings when PyYAML has been built with them
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class LineStream():
+    """
+        File-like object reading lines from an iterator
+        Lines may be transformed on the fly, only what the parser asks for is kept in memory
+    """
+
+    def __init__(self, lines, transform=None):
+        self.lines = iter(lines)
+        self.transform = transform
+        self.buffer = ''
+
+
+    def read(self, size=-1):
+        """Read at most size characters (everything left if size is negative)"""
+        while size < 0 or len(self.buffer) < size:
+            try:
+                line = next(self.lines)
+            except StopIteration:
+                break
+            if self.transform is not None:
+                line = self.transform(line)
+            self.buffer += line
+
+        if size < 0:
+            (data, self.buffer) = (self.buffer, '')
+        else:
+            (data, self.buffer) = (self.buffer[:size], self.buffer[size:])
+        return data
+
+
+def load_yaml_documents(stream):
+    """
+        Parse every document of a multi-document YAML stream (string or file object)
+        Documents are sent back one at a time, empty documents are skipped
+    """
+    for document in yaml.load_all(stream, Loader=YAML_LOADER):
+        if document is not None:
+            yield document
+
+
+def load_yaml(stream):
+    """Parse a single YAML document"""
+    return yaml.load(stream, Loader=YAML_LOADER)
+
+
+def dump_yaml(data):
+    """Serialize one object definition to YAML"""
+    return yaml.dump(data, Dumper=YAML_DUMPER)
+
+
+def load_json_documents(text):
+    """
+        Parse JSON objects printed by kops: one object, a list of objects or
+        objects printed one after the other
+    """
+    position = JSON_WHITESPACE_RE.match(text).end()
+    while position < len(text):
+        (document, position) = JSON_DECODER.raw_decode(text, position)
+        position = JSON_WHITESPACE_RE.match(text, position).end()
+        if isinstance(document, dict) and str(document.get('kind', '')).endswith('List'):
+            document = document.get('items') or []
+        if not isinstance(document, list):
+            document = [document]
+        for item in document:
+            if item is not None:
+                yield item
+
+
+def _json_default(value):
+    """Serialize timestamps parsed from YAML definitions"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+def dump_json(data):
+    """Serialize one object definition to compact JSON (C accelerated encoder)"""
+    return json.dumps(data, separators=(',', ':'), default=_json_default)
+
+
+def load_documents(text, wire_format):
+    """Parse kops output using wire format (json or yaml)"""
+    if wire_format == 'json':
+        return load_json_documents(text)
+    return load_yaml_documents(text)
+
+
+def dump(data, wire_format):
+    """Serialize one object definition using wire format (json or yaml)"""
+    if wire_format == 'json':
+        return dump_json(data)
+    return dump_yaml(data)
+
+
+def dump_all(objects, wire_format):
+    """Serialize object definitions as a multi-document stream (kops replace -f)"""
+    return '\n---\n'.join(dump(data, wire_format) for data in objects)
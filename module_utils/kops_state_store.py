@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Read cluster and instance group definitions straight from kops state store"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import abc
+import os
+import threading
+
+from ansible.module_utils.six import add_metaclass
+from ansible.module_utils.kops_serialization import load_yaml
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+
+class StateStoreError(Exception):
+    """Raised when state store can't be read"""
+
+
+@add_metaclass(abc.ABCMeta)
+class StateStoreReader():
+    """
+        Read kops objects from state store without launching kops
+
+        Layout of state store:
+          <state store>/<cluster name>/config
+          <state store>/<cluster name>/instancegroup/<instance group name>
+    """
+
+    def __init__(self, state_store):
+        self.state_store = state_store
+
+
+    @abc.abstractmethod
+    def _list_children(self, path):
+        """Send back names of objects and directories directly under path"""
+
+
+    @abc.abstractmethod
+    def _read_object(self, path):
+        """Send back content of an object (None if object does not exist)"""
+
+
+    @abc.abstractmethod
+    def get_fingerprint(self, cluster_name=None):
+        """
+            Cheap fingerprint of cluster objects (every cluster config if cluster_name is None)
+            Fingerprint changes as soon as one of these objects is modified
+        """
+
+
+    @staticmethod
+    def _parse(content):
+        return load_yaml(content)
+
+
+    def read_cluster(self, cluster_name):
+        """Retrieve cluster definition (None if cluster does not exist)"""
+        content = self._read_object(cluster_name + '/config')
+        if content is None:
+            return None
+        return self._parse(content)
+
+
+    def read_clusters(self):
+        """Retrieve definitions of every cluster stored in state store"""
+        clusters_definitions = {}
+        for name in self._list_children(''):
+            cluster_definition = self.read_cluster(name)
+            if cluster_definition is not None:
+                clusters_definitions[cluster_definition['metadata']['name']] = cluster_definition
+        return clusters_definitions
+
+
+    def read_instance_groups(self, cluster_name):
+        """Retrieve instance groups definitions of a cluster"""
+        nodes_definitions = {}
+        for name in self._list_children(cluster_name + '/instancegroup'):
+            content = self._read_object(cluster_name + '/instancegroup/' + name)
+            if content is None:
+                continue
+            definition = self._parse(content)
+            nodes_definitions[definition['metadata']['name']] = definition
+        return nodes_definitions
+
+
+class FileStateStoreReader(StateStoreReader):
+    """Read kops objects from a file:// state store"""
+
+    def __init__(self, state_store):
+        super(FileStateStoreReader, self).__init__(state_store)
+        self.root = state_store[len('file://'):]
+
+
+    def _list_children(self, path):
+        try:
+            return sorted(os.listdir(os.path.join(self.root, path)))
+        except OSError:
+            return []
+
+
+    def _read_object(self, path):
+        try:
+            with open(os.path.join(self.root, path)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+
+    def get_fingerprint(self, cluster_name=None):
+        """Fingerprint objects using their mtime and size"""
+        if cluster_name is None:
+            paths = [name + '/config' for name in self._list_children('')]
+        else:
+            paths = [cluster_name + '/config'] + [
+                cluster_name + '/instancegroup/' + name
+                for name in self._list_children(cluster_name + '/instancegroup')
+            ]
+
+        fingerprint = []
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(self.root, path))
+            except OSError:
+                continue
+            fingerprint.append([path, stat.st_mtime, stat.st_size])
+        return fingerprint
+
+
+class S3StateStoreReader(StateStoreReader):
+    """
+        Read kops objects from a s3:// state store
+
+        S3 clients are shared by every reader of the process so that HTTP
+        connections are pooled between reads. S3_ENDPOINT (also used by kops)
+        or endpoint let you target a S3 compatible store.
+    """
+
+    max_pool_connections = 10
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, state_store, endpoint=None):
+        super(S3StateStoreReader, self).__init__(state_store)
+        (self.bucket, _, prefix) = state_store[len('s3://'):].partition('/')
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.endpoint = endpoint or os.environ.get('S3_ENDPOINT') or None
+        self.client = self._get_client(self.endpoint)
+
+
+    @classmethod
+    def _get_client(cls, endpoint):
+        with cls._clients_lock:
+            if endpoint not in cls._clients:
+                config = Config(max_pool_connections=cls.max_pool_connections)
+                if endpoint is not None:
+                    # S3 compatible stores seldom support virtual hosted buckets
+                    config = config.merge(Config(s3={'addressing_style': 'path'}))
+                cls._clients[endpoint] = boto3.session.Session().client(
+                    's3', endpoint_url=endpoint, config=config
+                )
+            return cls._clients[endpoint]
+
+
+    def _list(self, path, delimiter=None):
+        """Send back (objects, common prefixes) under path"""
+        prefix = self.prefix + (path.strip('/') + '/' if path.strip('/') else '')
+        kwargs = dict(Bucket=self.bucket, Prefix=prefix)
+        if delimiter is not None:
+            kwargs['Delimiter'] = delimiter
+
+        objects = []
+        prefixes = []
+        try:
+            for page in self.client.get_paginator('list_objects_v2').paginate(**kwargs):
+                objects += page.get('Contents', [])
+                prefixes += [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+        except (BotoCoreError, ClientError) as e:
+            raise StateStoreError("Unable to list %s: %s" % (self.state_store + '/' + path, e))
+        return (objects, prefixes)
+
+
+    def _list_children(self, path):
+        (objects, prefixes) = self._list(path, delimiter='/')
+        prefix_length = len(self.prefix + (path.strip('/') + '/' if path.strip('/') else ''))
+        names = [o['Key'][prefix_length:] for o in objects]
+        names += [p[prefix_length:].rstrip('/') for p in prefixes]
+        return sorted(name for name in names if name)
+
+
+    def _read_object(self, path):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + path)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise StateStoreError("Unable to read %s: %s" % (self.state_store + '/' + path, e))
+        except BotoCoreError as e:
+            raise StateStoreError("Unable to read %s: %s" % (self.state_store + '/' + path, e))
+        return response['Body'].read().decode('utf-8')
+
+
+    def _get_etag(self, path):
+        """Send back ETag of an object (None if object does not exist)"""
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + path)['ETag']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', 'NotFound', '404'):
+                return None
+            raise StateStoreError("Unable to read %s: %s" % (self.state_store + '/' + path, e))
+        except BotoCoreError as e:
+            raise StateStoreError("Unable to read %s: %s" % (self.state_store + '/' + path, e))
+
+
+    def get_fingerprint(self, cluster_name=None):
+        """
+            Fingerprint objects using their ETag
+            Only cluster configs and instance groups are looked at (never pki, secrets or backups).
+            Cluster configs of the whole store are taken from a single listing instead of one
+            request per cluster.
+        """
+        if cluster_name is None:
+            (objects, _) = self._list('')
+            fingerprint = []
+            for o in objects:
+                path = o['Key'][len(self.prefix):]
+                if path.count('/') == 1 and path.endswith('/config'):
+                    fingerprint.append([path, o['ETag']])
+            return sorted(fingerprint)
+
+        fingerprint = []
+        etag = self._get_etag(cluster_name + '/config')
+        if etag is not None:
+            fingerprint.append([cluster_name + '/config', etag])
+        (objects, _) = self._list(cluster_name + '/instancegroup', delimiter='/')
+        fingerprint += [[o['Key'][len(self.prefix):], o['ETag']] for o in objects]
+        return sorted(fingerprint)
+
+
+def get_state_store_reader(state_store, endpoint=None):
+    """Send back a reader able to handle this state store (None if not supported)"""
+    if state_store.startswith('file://'):
+        return FileStateStoreReader(state_store)
+    if state_store.startswith('s3://') and HAS_BOTO3:
+        return S3StateStoreReader(state_store, endpoint)
+    return None
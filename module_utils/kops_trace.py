@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name
+
+"""Trace kops invocations and profile Kops modules"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import atexit
+import cProfile
+import json
+import re
+import threading
+
+SECRET_OPTION_RE = re.compile(r'^--?[\w-]*(password|secret|token|credential)[\w-]*', re.IGNORECASE)
+MASK = '********'
+
+_trace_file_lock = threading.Lock()
+
+
+def mask_secrets(argv):
+    """Send back argv with values of secret options (eg: --admin-password) masked"""
+    masked = []
+    mask_next = False
+    for arg in argv:
+        if mask_next:
+            masked.append(MASK)
+            mask_next = False
+            continue
+        match = SECRET_OPTION_RE.match(arg)
+        if match is not None and '=' in arg:
+            masked.append(arg.split('=', 1)[0] + '=' + MASK)
+        else:
+            masked.append(arg)
+            mask_next = match is not None
+    return masked
+
+
+def append_trace(trace_file, record):
+    """Append one trace record to a JSON lines file"""
+    with _trace_file_lock:
+        with open(trace_file, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def start_profiler(profile_file):
+    """
+        Profile Python side of the module until it exits (exit_json or fail_json)
+        Only the main thread is profiled. Statistics are read with pstats.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+
+    atexit.register(dump)
+    return profiler
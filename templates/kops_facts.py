@@ -11,6 +11,9 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 from ansible.module_utils.kops import Kops
+from ansible.module_utils.kops_progress import read_progress
+from ansible.module_utils.six import iteritems
+from ansible.utils.vars import merge_hash
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
                     'status': ['preview'],
@@ -42,6 +45,118 @@ options:
      type: string
      required: false
      default: None
+  cache_dir:
+     description:
+       - Directory used to keep kops reads between runs. Cache is disabled if not set.
+       - Entries are keyed by state store, cluster name and kops version and dropped on every change made by modules.
+     type: path
+     required: false
+     default: None
+  cache_ttl:
+     description:
+       - Number of seconds a cached kops read is considered valid.
+       - Entries are also dropped as soon as state store objects change (mtime with file:// state store, ETag with s3:// state store when boto3 is available).
+     type: int
+     required: false
+     default: 300
+  direct_read:
+     description:
+       - Read cluster and instance group definitions straight from the state store instead of launching kops.
+       - Supported with file:// and s3:// (boto3 required) state stores. kops is used for other state stores, for fully populated specifications and when state store can't be read.
+     type: bool
+     required: false
+     default: false
+  state_store_endpoint:
+     description:
+       - Endpoint of a S3 compatible state store used by direct reads (default to S3_ENDPOINT environment variable).
+     type: string
+     required: false
+     default: None
+  wire_format:
+     description:
+       - Format used to read and write kops objects.
+       - C(auto) uses json when kops supports it (kops >= 1.8) and yaml otherwise. Fully populated specifications are always read as yaml.
+     type: string
+     required: false
+     default: auto
+     choices: [ auto, json, yaml ]
+  trace_file:
+     description:
+       - File where a JSON line is appended for each kops process launched (same records as I(kops_trace)).
+     type: path
+     required: false
+     default: None
+  profile_file:
+     description:
+       - Profile Python side of the module with cProfile and dump statistics to this file when module exits (read them with pstats).
+       - Only the main thread is profiled.
+     type: path
+     required: false
+     default: None
+  read_timeout:
+     description:
+       - Seconds given to a kops read (eg: C(kops get)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 600
+  write_timeout:
+     description:
+       - Seconds given to a kops write (eg: C(kops replace), C(kops update cluster)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 1800
+  rolling_update_timeout:
+     description:
+       - Seconds given to a kops rolling update before its process group is stopped and the module fails. No timeout by default.
+       - Not applied to rolling updates started with I(rolling_update_progress_file).
+     type: int
+     required: false
+     default: None
+  task_timeout:
+     description:
+       - Seconds given to every kops command launched by the task. Commands are stopped once this deadline is reached.
+       - On timeout, commands already completed are sent back in I(completed_commands).
+     type: int
+     required: false
+     default: None
+  retries:
+     description:
+       - Number of times a failed kops command is launched again when its error is transient (eg: S3 C(SlowDown), API throttling, C(RequestLimitExceeded)).
+       - Only reads, C(kops replace), C(kops update cluster) and rolling update probes are retried. Other errors fail at once.
+     type: int
+     required: false
+     default: 3
+  retry_delay:
+     description:
+       - Base delay (seconds) between retries, doubled on each retry with random jitter (at most 60 seconds).
+     type: float
+     required: false
+     default: 1
+  rate_limit:
+     description:
+       - Maximum number of kops processes started per second against the state store (or I(rate_limit_key)), shared by every task and playbook of this host.
+       - Tokens are taken from a token bucket stored in I(rate_limit_dir) and locked with flock. No limit by default.
+     type: float
+     required: false
+     default: None
+  rate_limit_burst:
+     description:
+       - Number of kops processes which can be started at once before I(rate_limit) applies.
+     type: int
+     required: false
+     default: 5
+  rate_limit_key:
+     description:
+       - Name of the shared limit (eg: cloud account id) when several state stores use the same account. State store by default.
+     type: str
+     required: false
+     default: None
+  rate_limit_dir:
+     description:
+       - Directory of token buckets. C(kops-ansible-rate-limit) in temporary directory by default.
+     type: path
+     required: false
+     default: None
   failed_when_not_found:
      description:
        - Module will crash if cluster doesn't exist. No crash by default.
@@ -50,13 +165,42 @@ options:
      default: false
   full:
      description:
-       - Show fully populated configuration from kops.
+       - Show fully populated configuration from kops (same as C(full) in I(gather_subset)).
      type: bool
      required: false
      default: false
+  gather_subset:
+     description:
+       - Restrict facts to the given subsets, only kops reads needed by these subsets are launched.
+       - C(clusters) retrieves cluster definitions only, C(instancegroups) retrieves cluster definitions and their instance groups, C(full) retrieves fully populated cluster definitions and C(all) is the same as C(instancegroups).
+     type: list
+     required: false
+     default: [ all ]
+     choices: [ all, clusters, instancegroups, full ]
+  spec_paths:
+     description:
+       - Only send back these paths of cluster definitions (eg: C(spec.kubernetesVersion)).
+       - Path items are separated by dots, C(*) matches every key (eg: C(instancegroups.*.spec.machineType)).
+     type: list
+     required: false
+     default: None
+  read_workers:
+     description:
+       - Number of kops processes used concurrently to retrieve instance groups of every cluster.
+     type: int
+     required: false
+     default: 4
+  rolling_update_progress:
+     description:
+       - Progress file of a rolling update started with I(rolling_update_progress_file) (M(kops_cluster) or M(kops_ig)).
+       - When set, only rolling update progress is sent back (clusters are not read).
+     type: path
+     required: false
+     default: None
 
 notes:
    - kops bin is required
+   - boto3 is required to read s3:// state store without kops
 author:
    - Yannig Perré
 '''
@@ -64,12 +208,92 @@ author:
 EXAMPLES = '''
 - name: Retrieve kops cluster informations
   kops_facts:
+
+- name: Retrieve kubernetes version of every cluster without reading instance groups
+  kops_facts:
+    gather_subset: clusters
+    spec_paths:
+      - spec.kubernetesVersion
+
+- name: Wait for a rolling update started with rolling_update_progress_file
+  kops_facts:
+    rolling_update_progress: /tmp/test.example.org-rolling-update.log
+  register: progress
+  until: progress.rolling_update_progress.status != 'running'
+  retries: 120
+  delay: 30
 '''
 
 RETURN = '''
 ---
+timed_out:
+   description: True when a kops command has been stopped by I(read_timeout), I(write_timeout), I(rolling_update_timeout) or I(task_timeout)
+   returned: on timeout
+   type: bool
+completed_commands:
+   description: kops commands (without kops binary) completed before the timeout
+   returned: on timeout
+   type: list
+kops_trace:
+   description: One record per kops process launched with argv (secret values masked), start, duration (seconds), rc, stdout_bytes, stderr_bytes and caller (eg: get_nodes)
+   returned: always
+   type: list
+kops_invocations:
+   description: Number of kops processes launched by the module
+   returned: always
+   type: int
+kops_cached_reads:
+   description: Number of kops reads answered from cache instead of launching kops
+   returned: always
+   type: int
+state_store_reads:
+   description: Number of reads made straight from the state store instead of launching kops
+   returned: always
+   type: int
+kops_retries:
+   description: Number of kops commands launched again after a transient error
+   returned: always
+   type: int
+kops_retry_time:
+   description: Seconds spent waiting between retries
+   returned: always
+   type: float
+kops_rate_limit_wait:
+   description: Seconds spent waiting for the rate limiter before launching kops
+   returned: always
+   type: float
+rolling_update_progress:
+   description:
+     - Progress of a detached rolling update, status is C(running), C(succeeded), C(failed) or C(lost) (process gone without exit code)
+     - events are parsed from kops output (draining, drained, terminating, validating, validated, not_validated, completed) with their node, instance group and time
+     - timings holds time spent on each node (drain, terminate, validation) and instance group (duration) so far
+   returned: when rolling_update_progress is set
+   type: dict
 '''
 
+def project_paths(definition, paths):
+    """Copy of definition keeping only given paths (lists of keys, '*' matches any key)"""
+    projection = {}
+    for path in paths:
+        if not path:
+            return definition
+        keys = list(definition) if path[0] == '*' else [path[0]]
+        for key in keys:
+            if key not in definition:
+                continue
+            value = definition[key]
+            if len(path) > 1:
+                if not isinstance(value, dict):
+                    continue
+                value = project_paths(value, [path[1:]])
+                if not value:
+                    continue
+                if isinstance(projection.get(key), dict):
+                    value = merge_hash(projection[key], value)
+            projection[key] = value
+    return projection
+
+
 class KopsFacts(Kops):
     """Retrieve facts from existing cluster"""
 
@@ -78,18 +302,39 @@ class KopsFacts(Kops):
         additional_module_args = dict(
             failed_when_not_found=dict(type=bool, default=False),
             full=dict(type=bool, default=False),
+            gather_subset=dict(
+                type='list', default=['all'], choices=['all', 'clusters', 'instancegroups', 'full']
+            ),
+            spec_paths=dict(type='list'),
+            read_workers=dict(type=int, default=4),
+            rolling_update_progress=dict(type='path'),
+        )
+        super(KopsFacts, self).__init__(
+            additional_module_args=additional_module_args, supports_check_mode=True
         )
-        super(KopsFacts, self).__init__(additional_module_args=additional_module_args)
 
     def get_facts(self):
         """Retrieve clusters definition"""
         cluster_name = self.module.params['name']
+        gather_subset = self.module.params['gather_subset']
         clusters_definitions = self.get_clusters(
             cluster_name,
+            retrieve_ig='all' in gather_subset or 'instancegroups' in gather_subset,
             failed_when_not_found=self.module.params['failed_when_not_found'],
-            full=self.module.params['full']
+            full=self.module.params['full'] or 'full' in gather_subset
         )
 
+        spec_paths = self.module.params['spec_paths']
+        if spec_paths is not None:
+            paths = [path.split('.') for path in spec_paths]
+            if cluster_name is not None:
+                clusters_definitions = project_paths(clusters_definitions, paths)
+            else:
+                clusters_definitions = dict(
+                    (name, project_paths(definition, paths))
+                    for (name, definition) in iteritems(clusters_definitions)
+                )
+
         ansible_facts = {
             'kops_path': self.kops_cmd,
             'kops_clusters_definitions': clusters_definitions,
@@ -101,14 +346,32 @@ class KopsFacts(Kops):
         return ansible_facts
 
 
+    def get_rolling_update_progress(self, progress_file):
+        """Retrieve progress of a rolling update started with rolling_update_progress_file"""
+        progress = read_progress(progress_file)
+        if progress is None:
+            self.module_fail_json(msg="No rolling update started with this progress file",
+                                  progress_file=progress_file)
+        return progress
+
+
     def exit_json(self):
         """Send back result to Ansible"""
+        if self.module.params['rolling_update_progress'] is not None:
+            self.module_exit_json(
+                changed=False,
+                rolling_update_progress=self.get_rolling_update_progress(
+                    self.module.params['rolling_update_progress']
+                )
+            )
+            return
+
         results = dict(
             changed=False,
             ansible_facts=self.get_facts()
         )
 
-        self.module.exit_json(**results)
+        self.module_exit_json(**results)
 
 
 def main():
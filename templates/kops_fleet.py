@@ -0,0 +1,406 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# (c) 2018, Yannig Perré <yannig.perre@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: disable=invalid-name,dangerous-default-value,duplicate-code
+
+"""Handle state of several kops clusters at once"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import time
+
+from ansible.module_utils.kops import Kops, KopsError, KopsModuleView
+from ansible.module_utils.kops_cluster_handler import KopsClusterHandler
+from ansible.module_utils.six import iteritems
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: kops_fleet
+short_description: Handle several clusters with kops
+description:
+     - Let you create, update or delete a list of clusters using kops
+     - Clusters are handled concurrently, steps of one cluster (update, rolling update) are run in order
+version_added: "2.8"
+options:
+  clusters:
+     description:
+       - List of clusters definitions.
+       - Each item accepts I(name) (required), I(state) (C(present), C(updated) or C(absent), default to C(present)), I(cloud), I(docker), I(additional_policies) and every cluster creation and rolling update options of M(kops_cluster).
+       - A cluster must be listed only once.
+     type: list
+     required: true
+  workers:
+     description:
+       - Number of clusters handled at the same time
+     type: int
+     required: false
+     default: 4
+  state_store:
+     description:
+       - State store (eg: s3://my-state-store)
+     type: string
+     required: false
+     default: None
+  kops_cmd:
+     description:
+       - kops bin path
+     type: string
+     required: false
+     default: None
+  cache_dir:
+     description:
+       - Directory used to keep kops reads between runs. Cache is disabled if not set.
+       - Entries are keyed by state store, cluster name and kops version and dropped on every change made by modules.
+     type: path
+     required: false
+     default: None
+  cache_ttl:
+     description:
+       - Number of seconds a cached kops read is considered valid.
+       - Entries are also dropped as soon as state store objects change (mtime with file:// state store, ETag with s3:// state store when boto3 is available).
+     type: int
+     required: false
+     default: 300
+  direct_read:
+     description:
+       - Read cluster and instance group definitions straight from the state store instead of launching kops.
+       - Supported with file:// and s3:// (boto3 required) state stores. kops is used for other state stores, for fully populated specifications and when state store can't be read.
+     type: bool
+     required: false
+     default: false
+  state_store_endpoint:
+     description:
+       - Endpoint of a S3 compatible state store used by direct reads (default to S3_ENDPOINT environment variable).
+     type: string
+     required: false
+     default: None
+  wire_format:
+     description:
+       - Format used to read and write kops objects.
+       - C(auto) uses json when kops supports it (kops >= 1.8) and yaml otherwise. Fully populated specifications are always read as yaml.
+     type: string
+     required: false
+     default: auto
+     choices: [ auto, json, yaml ]
+  trace_file:
+     description:
+       - File where a JSON line is appended for each kops process launched (same records as I(kops_trace)).
+     type: path
+     required: false
+     default: None
+  profile_file:
+     description:
+       - Profile Python side of the module with cProfile and dump statistics to this file when module exits (read them with pstats).
+       - Only the main thread is profiled.
+     type: path
+     required: false
+     default: None
+  read_timeout:
+     description:
+       - Seconds given to a kops read (eg: C(kops get)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 600
+  write_timeout:
+     description:
+       - Seconds given to a kops write (eg: C(kops replace), C(kops update cluster)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 1800
+  rolling_update_timeout:
+     description:
+       - Seconds given to a kops rolling update before its process group is stopped and the module fails. No timeout by default.
+       - Not applied to rolling updates started with I(rolling_update_progress_file).
+     type: int
+     required: false
+     default: None
+  task_timeout:
+     description:
+       - Seconds given to every kops command launched by the task. Commands are stopped once this deadline is reached.
+       - On timeout, commands already completed are sent back in I(completed_commands).
+     type: int
+     required: false
+     default: None
+  retries:
+     description:
+       - Number of times a failed kops command is launched again when its error is transient (eg: S3 C(SlowDown), API throttling, C(RequestLimitExceeded)).
+       - Only reads, C(kops replace), C(kops update cluster) and rolling update probes are retried. Other errors fail at once.
+     type: int
+     required: false
+     default: 3
+  retry_delay:
+     description:
+       - Base delay (seconds) between retries, doubled on each retry with random jitter (at most 60 seconds).
+     type: float
+     required: false
+     default: 1
+  rate_limit:
+     description:
+       - Maximum number of kops processes started per second against the state store (or I(rate_limit_key)), shared by every task and playbook of this host.
+       - Tokens are taken from a token bucket stored in I(rate_limit_dir) and locked with flock. No limit by default.
+     type: float
+     required: false
+     default: None
+  rate_limit_burst:
+     description:
+       - Number of kops processes which can be started at once before I(rate_limit) applies.
+     type: int
+     required: false
+     default: 5
+  rate_limit_key:
+     description:
+       - Name of the shared limit (eg: cloud account id) when several state stores use the same account. State store by default.
+     type: str
+     required: false
+     default: None
+  rate_limit_dir:
+     description:
+       - Directory of token buckets. C(kops-ansible-rate-limit) in temporary directory by default.
+     type: path
+     required: false
+     default: None
+  rolling_update_concurrency:
+     description:
+       - Roll instance groups needing update with one kops process each instead of one kops rolling update of the whole cluster.
+       - Masters are rolled first, one at a time, then at most I(rolling_update_concurrency) node groups are rolled at the same time.
+       - First failure stops every running rolling update. Duration of each instance group is sent back in I(rolling_update).
+     type: int
+     required: false
+     default: None
+  journal_dir:
+     description:
+       - Directory of a local journal recording a fingerprint of cluster and instance groups specifications (and kops version) once they are successfully applied.
+       - When specifications still match the journal, C(kops update cluster) and rolling update probe are skipped.
+       - Changes made outside of these modules are not detected, use I(force_apply) to check the cloud again.
+     type: path
+     required: false
+     default: None
+  force_apply:
+     description:
+       - Check and apply cloud changes even if the journal reports specifications as already applied.
+       - Without it, C(kops update cluster) is only run when the task changes cluster or instance groups specifications.
+     type: bool
+     required: false
+     default: false
+notes:
+   - kops bin is required
+   - boto3 is required to read s3:// state store without kops
+   - Module fails when one cluster can't be handled, other clusters are still handled and reported in I(clusters)
+author:
+   - Yannig Perré
+'''
+
+EXAMPLES = '''
+- name: Create and update clusters with kops
+  kops_fleet:
+    workers: 2
+    clusters:
+      - name: first.example.org
+        zones: eu-west-1a
+        state: updated
+      - name: second.example.org
+        zones: eu-west-1b
+        kubernetes_version: 1.11.6
+        state: updated
+      - name: old.example.org
+        state: absent
+'''
+
+RETURN = '''
+---
+clusters:
+   description: Result of every cluster (changed, failed, msg, spec_changes, change_impacts, spec_fingerprint, duration in seconds and kops statistics) keyed by cluster name
+   returned: always
+   type: dict
+duration:
+   description: Time spent (in seconds) handling every cluster
+   returned: always
+   type: float
+rolling_update:
+   description: Result of each instance group (name, status, duration in seconds) when I(rolling_update_concurrency) is set
+   returned: when instance groups are rolled
+   type: dict
+planned_commands:
+   description: kops commands (without kops binary and state store) which would have been launched to apply changes
+   returned: check mode
+   type: list
+timed_out:
+   description: True when a kops command has been stopped by I(read_timeout), I(write_timeout), I(rolling_update_timeout) or I(task_timeout)
+   returned: on timeout
+   type: bool
+completed_commands:
+   description: kops commands (without kops binary) completed before the timeout
+   returned: on timeout
+   type: list
+kops_trace:
+   description: One record per kops process launched with argv (secret values masked), start, duration (seconds), rc, stdout_bytes, stderr_bytes and caller (eg: get_nodes)
+   returned: always
+   type: list
+kops_invocations:
+   description: Number of kops processes launched by the module
+   returned: always
+   type: int
+kops_cached_reads:
+   description: Number of kops reads answered from cache instead of launching kops
+   returned: always
+   type: int
+state_store_reads:
+   description: Number of reads made straight from the state store instead of launching kops
+   returned: always
+   type: int
+kops_retries:
+   description: Number of kops commands launched again after a transient error
+   returned: always
+   type: int
+kops_retry_time:
+   description: Seconds spent waiting between retries
+   returned: always
+   type: float
+kops_rate_limit_wait:
+   description: Seconds spent waiting for the rate limiter before launching kops
+   returned: always
+   type: float
+'''
+
+
+class KopsFleetCluster(KopsClusterHandler):
+    """Handle state of one cluster of the fleet"""
+
+    def __init__(self, module, params, options_definition, kops_version, deadline):
+        super(KopsFleetCluster, self).__init__(
+            options_definition=options_definition,
+            module=KopsModuleView(module, params)
+        )
+        self.kops_version = kops_version
+        # Clusters share the deadline of the task
+        self.deadline = deadline
+
+
+class KopsFleet(Kops):
+    """Handle state for a list of kops clusters"""
+
+    def __init__(self):
+        """Init module parameters"""
+        additional_module_args = dict(
+            clusters=dict(type='list', elements='dict', required=True, options=dict(
+                name=dict(type=str, required=True),
+                state=dict(choices=['present', 'absent', 'updated'], default='present'),
+                cloud=dict(choices=['gce', 'aws', 'vsphere'], default='aws'),
+                docker=dict(type=dict),
+                additional_policies=dict(
+                    type=dict, aliases=['additional-policies', 'additionalPolicies']
+                ),
+{%- for option in cluster_options + rolling_update_options %}
+{%    if option.name not in ['cloud'] -%}
+{{''}}                {{ option.name }}=dict(type={{ option.type|replace('list','str') }}{% if option.alias != option.name %}, aliases=['{{ option.alias }}']{% endif %}),
+{%-    endif %}
+{%- endfor %}
+            )),
+            workers=dict(type=int, default=4),
+            rolling_update_concurrency=dict(type=int),
+            journal_dir=dict(type='path'),
+            force_apply=dict(type=bool, default=False),
+        )
+        # pylint: disable=line-too-long
+        options_definition = {
+{%- for option in cluster_options + rolling_update_options %}
+            '{{ option.name }}': {{ option }},
+{%- endfor %}
+        }
+        super(KopsFleet, self).__init__(
+            additional_module_args, options_definition, supports_check_mode=True
+        )
+
+
+    def get_cluster_params(self, cluster):
+        """Send back module parameters overridden by cluster definition"""
+        params = dict(self.module.params)
+        del params['clusters']
+        for (param, value) in iteritems(cluster):
+            if value is not None or param not in params:
+                params[param] = value
+        return params
+
+
+    def check_cluster_state(self, cluster):
+        """Bring one cluster to its expected state (every step of the cluster is run in order)"""
+        start = time.time()
+        handler = KopsFleetCluster(
+            self.module, self.get_cluster_params(cluster),
+            self.options_definition, self.get_kops_version() or (), self.deadline
+        )
+        try:
+            results = handler.check_cluster_state()
+            handler.flush_cluster_updates()
+            results['failed'] = False
+        except KopsError as e:
+            results = dict(e.results, cluster_name=cluster['name'], changed=False, failed=True)
+        results['spec_changes'] = handler.spec_changes
+        with self._lock:
+            self.kops_trace += handler.kops_trace
+        if self.module.check_mode:
+            results['planned_commands'] = handler.get_planned_commands()
+            with self._lock:
+                self.planned_commands += handler.planned_commands
+        results['duration'] = round(time.time() - start, 3)
+        results.update(handler.get_kops_statistics())
+        return results
+
+
+    def exit_json(self):
+        """Send back result to Ansible"""
+        names = [cluster['name'] for cluster in self.module.params['clusters']]
+        duplicates = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicates:
+            self.module_fail_json(msg="Clusters listed more than once: %s" % ", ".join(duplicates))
+
+        # kops version is detected once for every cluster
+        self.get_kops_version()
+
+        start = time.time()
+        clusters = dict(zip(names, self._map_in_pool(
+            self.check_cluster_state,
+            self.module.params['clusters'],
+            workers=self.module.params['workers']
+        )))
+
+        for results in clusters.values():
+            self.kops_invocations += results['kops_invocations']
+            self.kops_cached_reads += results['kops_cached_reads']
+            self.state_store_reads += results['state_store_reads']
+            self.kops_retries += results['kops_retries']
+            self.kops_retry_time += results['kops_retry_time']
+            self.kops_rate_limit_wait += results['kops_rate_limit_wait']
+
+        results = dict(
+            changed=any(r['changed'] for r in clusters.values()),
+            clusters=clusters,
+            duration=round(time.time() - start, 3),
+        )
+        failed = sorted(name for (name, r) in iteritems(clusters) if r['failed'])
+        if failed:
+            self.module_fail_json(
+                msg="Unable to handle clusters: %s" % ", ".join(failed),
+                **results
+            )
+
+        self.module_exit_json(**results)
+
+
+def main():
+    """Kops fleet handling"""
+    fleet = KopsFleet()
+    fleet.exit_json()
+
+
+if __name__ == '__main__':
+    main()
+
@@ -42,12 +42,165 @@ options:
      type: string
      required: false
      default: None
+  cache_dir:
+     description:
+       - Directory used to keep kops reads between runs. Cache is disabled if not set.
+       - Entries are keyed by state store, cluster name and kops version and dropped on every change made by modules.
+     type: path
+     required: false
+     default: None
+  cache_ttl:
+     description:
+       - Number of seconds a cached kops read is considered valid.
+       - Entries are also dropped as soon as state store objects change (mtime with file:// state store, ETag with s3:// state store when boto3 is available).
+     type: int
+     required: false
+     default: 300
+  direct_read:
+     description:
+       - Read cluster and instance group definitions straight from the state store instead of launching kops.
+       - Supported with file:// and s3:// (boto3 required) state stores. kops is used for other state stores, for fully populated specifications and when state store can't be read.
+     type: bool
+     required: false
+     default: false
+  state_store_endpoint:
+     description:
+       - Endpoint of a S3 compatible state store used by direct reads (default to S3_ENDPOINT environment variable).
+     type: string
+     required: false
+     default: None
+  wire_format:
+     description:
+       - Format used to read and write kops objects.
+       - C(auto) uses json when kops supports it (kops >= 1.8) and yaml otherwise. Fully populated specifications are always read as yaml.
+     type: string
+     required: false
+     default: auto
+     choices: [ auto, json, yaml ]
+  trace_file:
+     description:
+       - File where a JSON line is appended for each kops process launched (same records as I(kops_trace)).
+     type: path
+     required: false
+     default: None
+  profile_file:
+     description:
+       - Profile Python side of the module with cProfile and dump statistics to this file when module exits (read them with pstats).
+       - Only the main thread is profiled.
+     type: path
+     required: false
+     default: None
+  read_timeout:
+     description:
+       - Seconds given to a kops read (eg: C(kops get)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 600
+  write_timeout:
+     description:
+       - Seconds given to a kops write (eg: C(kops replace), C(kops update cluster)) before its process group is stopped and the module fails.
+     type: int
+     required: false
+     default: 1800
+  rolling_update_timeout:
+     description:
+       - Seconds given to a kops rolling update before its process group is stopped and the module fails. No timeout by default.
+       - Not applied to rolling updates started with I(rolling_update_progress_file).
+     type: int
+     required: false
+     default: None
+  task_timeout:
+     description:
+       - Seconds given to every kops command launched by the task. Commands are stopped once this deadline is reached.
+       - On timeout, commands already completed are sent back in I(completed_commands).
+     type: int
+     required: false
+     default: None
+  retries:
+     description:
+       - Number of times a failed kops command is launched again when its error is transient (eg: S3 C(SlowDown), API throttling, C(RequestLimitExceeded)).
+       - Only reads, C(kops replace), C(kops update cluster) and rolling update probes are retried. Other errors fail at once.
+     type: int
+     required: false
+     default: 3
+  retry_delay:
+     description:
+       - Base delay (seconds) between retries, doubled on each retry with random jitter (at most 60 seconds).
+     type: float
+     required: false
+     default: 1
+  rate_limit:
+     description:
+       - Maximum number of kops processes started per second against the state store (or I(rate_limit_key)), shared by every task and playbook of this host.
+       - Tokens are taken from a token bucket stored in I(rate_limit_dir) and locked with flock. No limit by default.
+     type: float
+     required: false
+     default: None
+  rate_limit_burst:
+     description:
+       - Number of kops processes which can be started at once before I(rate_limit) applies.
+     type: int
+     required: false
+     default: 5
+  rate_limit_key:
+     description:
+       - Name of the shared limit (eg: cloud account id) when several state stores use the same account. State store by default.
+     type: str
+     required: false
+     default: None
+  rate_limit_dir:
+     description:
+       - Directory of token buckets. C(kops-ansible-rate-limit) in temporary directory by default.
+     type: path
+     required: false
+     default: None
+  rolling_update_concurrency:
+     description:
+       - Roll instance groups needing update with one kops process each instead of one kops rolling update of the whole cluster.
+       - Masters are rolled first, one at a time, then at most I(rolling_update_concurrency) node groups are rolled at the same time.
+       - First failure stops every running rolling update. Duration of each instance group is sent back in I(rolling_update).
+     type: int
+     required: false
+     default: None
+  journal_dir:
+     description:
+       - Directory of a local journal recording a fingerprint of cluster and instance groups specifications (and kops version) once they are successfully applied.
+       - When specifications still match the journal, C(kops update cluster) and rolling update probe are skipped.
+       - Changes made outside of these modules are not detected, use I(force_apply) to check the cloud again.
+     type: path
+     required: false
+     default: None
+  force_apply:
+     description:
+       - Check and apply cloud changes even if the journal reports specifications as already applied.
+       - Without it, C(kops update cluster) is only run when the task changes cluster or instance groups specifications.
+     type: bool
+     required: false
+     default: false
+  rolling_update_progress_file:
+     description:
+       - Start rolling update in a detached process instead of waiting for it. kops output is written to this file.
+       - Module returns as soon as rolling update is started, progress is read with M(kops_facts) I(rolling_update_progress) option.
+       - Can't be used with I(rolling_update_concurrency).
+       - Module fails when a rolling update recorded in this file is still running.
+     type: path
+     required: false
+     default: None
   ig_name:
      description:
        - Instance group name.
+       - One of I(ig_name) or I(instance_groups) is required.
      type: string
-     required: true
+     required: false
      aliases: igName, ig-name
+  instance_groups:
+     description:
+       - List of instance groups reconciled in one run, in place of I(ig_name) and instance group options.
+       - Each item accepts I(name) (required), I(state) (C(present) or C(absent), default to module I(state)), I(image), I(machine_type), I(min_size), I(max_size), I(root_volume_size), I(subnets) and instance group creation options.
+       - Instance groups are read once, every spec change is sent with one kops replace and, with C(state=updated), cluster is updated and rolled once at the end.
+     type: list
+     required: false
+     default: None
   image:
      description:
        - Image used to launch kube nodes (eg: kope.io/k8s-1.10-debian-jessie-amd64-hvm-ebs-2018-08-17)
@@ -92,6 +245,7 @@ options:
      description:
        - If C(present), cluster will be created
        - If C(updated), cluster will be created and check that the cluster is updated
+       - Rolling update is limited to instance groups handled by the module (created or updated ones with I(instance_groups))
        - If C(absent), cluster will be deleted
      type: string
      required: false
@@ -108,6 +262,7 @@ options:
 
 notes:
    - kops bin is required
+   - boto3 is required to read s3:// state store without kops
 author:
    - Yannig Perré
 '''
@@ -115,19 +270,113 @@ author:
 EXAMPLES = '''
 - name: Retrieve kops cluster informations
   kops_ig:
+
+- name: Reconcile several instance groups at once
+  kops_ig:
+    name: test.example.org
+    state: updated
+    instance_groups:
+      - name: nodes-small
+        machine_type: t2.medium
+        min_size: 1
+        max_size: 3
+      - name: nodes-large
+        machine_type: m5.xlarge
+      - name: nodes-old
+        state: absent
 '''
 
 RETURN = '''
 ---
+spec_changes:
+   description: Spec paths really changed by the module (eg: spec.kubernetesVersion), keyed by cluster or instance group name
+   returned: always
+   type: dict
+change_impacts:
+   description:
+     - Impacts of spec changes made by the module (C(update-only), C(roll-masters), C(roll-nodes)), null when unknown or nothing changed
+     - With C(update-only) changes (eg: I(min_size), I(max_size), I(admin_access)), rolling update is not probed. With C(roll-masters) or C(roll-nodes) only, rolling update is limited to these instance groups.
+   returned: when changes are applied
+   type: list
+spec_fingerprint:
+   description: Hash of cluster and instance groups specifications recorded in journal
+   returned: when I(journal_dir) is set and changes are applied
+   type: str
+spec_already_applied:
+   description: True when update and rolling update were skipped as journal reports specifications as applied
+   returned: when I(journal_dir) is set and changes are applied
+   type: bool
+rolling_update:
+   description: Result of each instance group (name, status, duration in seconds) when I(rolling_update_concurrency) is set
+   returned: when instance groups are rolled
+   type: dict
+rolling_update_timings:
+   description:
+     - Time spent (in seconds) on each node (drain, terminate and validation) and instance group (duration), parsed from kops output
+     - Unknown values (step skipped by kops) are null
+   returned: when instance groups are rolled
+   type: dict
+rolling_update_progress:
+   description: Detached rolling update (status, pid and progress_file) when I(rolling_update_progress_file) is set
+   returned: when rolling update is started
+   type: dict
+planned_commands:
+   description: kops commands (without kops binary and state store) which would have been launched to apply changes
+   returned: check mode
+   type: list
+timed_out:
+   description: True when a kops command has been stopped by I(read_timeout), I(write_timeout), I(rolling_update_timeout) or I(task_timeout)
+   returned: on timeout
+   type: bool
+completed_commands:
+   description: kops commands (without kops binary) completed before the timeout
+   returned: on timeout
+   type: list
+kops_trace:
+   description: One record per kops process launched with argv (secret values masked), start, duration (seconds), rc, stdout_bytes, stderr_bytes and caller (eg: get_nodes)
+   returned: always
+   type: list
+kops_invocations:
+   description: Number of kops processes launched by the module
+   returned: always
+   type: int
+kops_cached_reads:
+   description: Number of kops reads answered from cache instead of launching kops
+   returned: always
+   type: int
+state_store_reads:
+   description: Number of reads made straight from the state store instead of launching kops
+   returned: always
+   type: int
+kops_retries:
+   description: Number of kops commands launched again after a transient error
+   returned: always
+   type: int
+kops_retry_time:
+   description: Seconds spent waiting between retries
+   returned: always
+   type: float
+kops_rate_limit_wait:
+   description: Seconds spent waiting for the rate limiter before launching kops
+   returned: always
+   type: float
+instance_groups:
+   description: Action done on each instance group (created, updated, deleted, unchanged or absent) when I(instance_groups) is used
+   returned: when instance_groups is set
+   type: dict
 '''
 
 class KopsInstanceGroup(Kops):
     """Handle instance group creation"""
 
+    INSTANCE_GROUP_PARAMETERS = [
+        'image', 'machine_type', 'max_size', 'min_size', 'root_volume_size', 'subnets'
+    ]
+
     def __init__(self):
         """Init module parameters"""
         additional_module_args = dict(
-            ig_name=dict(type=str, required=True, aliases=['ig-name', 'igName']),
+            ig_name=dict(type=str, aliases=['ig-name', 'igName']),
             state=dict(choices=['present', 'absent', 'updated'], default='present'),
             image=dict(type=str, default=None),
             machine_type=dict(type=str, default=None, aliases=['machineType', 'machine-type']),
@@ -140,6 +389,25 @@ class KopsInstanceGroup(Kops):
 {%- for option in ig_options %}
 {{''}}            {{ option.name }}=dict(type={{ option.type|replace('list','str') }}{% if option.alias != option.name %}, aliases=['{{ option.alias }}']{% endif %}),
 {%- endfor %}
+            rolling_update_concurrency=dict(type=int),
+            rolling_update_progress_file=dict(type='path'),
+            journal_dir=dict(type='path'),
+            force_apply=dict(type=bool, default=False),
+            instance_groups=dict(type='list', elements='dict', options=dict(
+                name=dict(type=str, required=True),
+                state=dict(choices=['present', 'absent']),
+                image=dict(type=str),
+                machine_type=dict(type=str, aliases=['machineType', 'machine-type']),
+                max_size=dict(type=int, aliases=['maxSize', 'max-size']),
+                min_size=dict(type=int, aliases=['minSize', 'min-size']),
+                root_volume_size=dict(type=int, aliases=[
+                    'rootVolumeSize', 'root-volume-size', 'node_size', 'node-size', 'nodeSize'
+                ]),
+                subnets=dict(type=list),
+{%- for option in ig_options %}
+{{''}}                {{ option.name }}=dict(type={{ option.type|replace('list','str') }}{% if option.alias != option.name %}, aliases=['{{ option.alias }}']{% endif %}),
+{%- endfor %}
+            )),
         )
         # pylint: disable=line-too-long
         options_definition = {
@@ -147,25 +415,29 @@ class KopsInstanceGroup(Kops):
             '{{ option.name }}': {{ option }},
 {%- endfor %}
         }
-        super(KopsInstanceGroup, self).__init__(additional_module_args, options_definition)
+        super(KopsInstanceGroup, self).__init__(
+            additional_module_args,
+            options_definition,
+            mutually_exclusive=[
+                ['ig_name', 'instance_groups'],
+                ['rolling_update_concurrency', 'rolling_update_progress_file'],
+            ],
+            required_one_of=[['ig_name', 'instance_groups']],
+            supports_check_mode=True
+        )
+
+
+    def get_spec_to_merge(self, ig_definition, ig_params):
+        """Send back spec fields of instance group that really differ from expected parameters"""
+        return self.get_spec_changes(ig_definition, dict(
+            (to_camel_case(param), ig_params.get(param)) for param in self.INSTANCE_GROUP_PARAMETERS
+        ))
 
 
     def update_ig(self, cluster_name, ig_name):
         """Update instance group"""
         ig_definition = self.get_nodes(cluster_name, ig_name)
-        spec_to_merge = {}
-        instance_group_parameters = [
-            'image', 'machine_type', 'max_size', 'min_size', 'root_volume_size', 'subnets'
-        ]
-        for param in instance_group_parameters:
-            value = self.module.params[param]
-            if to_camel_case(param) in ig_definition['spec']:
-                current_value = ig_definition['spec'][to_camel_case(param)]
-            else:
-                current_value = None
-
-            if value is not None and value != current_value:
-                spec_to_merge[to_camel_case(param)] = value
+        spec_to_merge = self.get_spec_to_merge(ig_definition, self.module.params)
 
         return self.update_object_definition(cluster_name, ig_definition, spec_to_merge)
 
@@ -176,12 +448,18 @@ class KopsInstanceGroup(Kops):
 
         (result, out, err) = self.run_command(cmd, add_optional_args_from_tag="create-ig")
         if result > 0:
-            self.module.fail_json(msg=err, cmd=cmd)
+            self.module_fail_json(msg=err, cmd=cmd)
 
-        self.update_ig(cluster_name, ig_name)
+        if self.module.check_mode:
+            self.planned_instance_groups.setdefault(cluster_name, []).append(ig_name)
+        else:
+            self.update_ig(cluster_name, ig_name)
 
         if self.module.params['state'] in ['updated', 'started']:
-            return self._apply_modifications(cluster_name)
+            if self.module.check_mode:
+                # Instance group is not created: cluster update can't be previewed by kops
+                self.pending_cluster_updates.append(cluster_name)
+            return self._apply_modifications(cluster_name, [ig_name])
 
         return dict(
             changed=True,
@@ -197,7 +475,7 @@ class KopsInstanceGroup(Kops):
             ["delete", "instancegroup", "--yes", "--name", cluster_name, ig_name]
         )
         if result > 0:
-            self.module.fail_json(msg=err)
+            self.module_fail_json(msg=err)
         return dict(
             changed=True,
             kops_output=out,
@@ -214,7 +492,7 @@ class KopsInstanceGroup(Kops):
                 nodes_definition = self.get_nodes(cluster_name)
 
             if self.module.params['state'] in ['updated', 'started']:
-                return self._apply_modifications(cluster_name)
+                return self._apply_modifications(cluster_name, [ig_name])
 
             return dict(
                 changed=changed,
@@ -236,6 +514,84 @@ class KopsInstanceGroup(Kops):
         return self.delete_ig(cluster_name, ig_name)
 
 
+    def check_instance_groups_state(self, instance_groups):
+        """Reconcile several instance groups of a cluster in one run"""
+        cluster_name = self.module.params['name']
+        state = self.module.params['state']
+        default_ig_state = 'absent' if state == 'absent' else 'present'
+        nodes_definition = self.get_nodes(cluster_name=cluster_name)
+
+        actions = {}
+        present_instance_groups = []
+        for ig_params in instance_groups:
+            ig_name = ig_params['name']
+            if (ig_params['state'] or default_ig_state) == 'absent':
+                if ig_name in nodes_definition:
+                    self.delete_ig(cluster_name, ig_name)
+                    actions[ig_name] = 'deleted'
+                else:
+                    actions[ig_name] = 'absent'
+                continue
+
+            present_instance_groups.append(ig_params)
+            if ig_name not in nodes_definition:
+                cmd = ["create", "instancegroup", "--edit=false", "--name", cluster_name, ig_name]
+                (result, _, err) = self.run_command(
+                    cmd, add_optional_args_from_tag="create-ig", params=ig_params
+                )
+                if result > 0:
+                    self.module_fail_json(msg=err, cmd=cmd, actions=actions)
+                actions[ig_name] = 'created'
+                if self.module.check_mode:
+                    self.planned_instance_groups.setdefault(cluster_name, []).append(ig_name)
+
+        if 'created' in actions.values():
+            if self.module.check_mode:
+                # Instance groups are not created: cluster update can't be previewed by kops
+                if state in ['updated', 'started']:
+                    self.pending_cluster_updates.append(cluster_name)
+            else:
+                nodes_definition = self.get_nodes(cluster_name=cluster_name)
+
+        # Every spec change is sent to kops at once
+        objects_updates = []
+        for ig_params in present_instance_groups:
+            ig_name = ig_params['name']
+            if ig_name not in nodes_definition:
+                # Created in check mode
+                continue
+            spec_to_merge = self.get_spec_to_merge(nodes_definition[ig_name], ig_params)
+            if spec_to_merge:
+                objects_updates.append((nodes_definition[ig_name], spec_to_merge))
+                actions.setdefault(ig_name, 'updated')
+            actions.setdefault(ig_name, 'unchanged')
+
+        if self.update_objects_definitions(cluster_name, objects_updates):
+            nodes_definition = self.get_nodes(cluster_name=cluster_name)
+
+        changed = any(action in ['created', 'updated', 'deleted'] for action in actions.values())
+        results = dict(
+            changed=changed,
+            cluster_name=cluster_name,
+            instance_groups=actions,
+            nodes_definition=dict(
+                (ig_params['name'], nodes_definition[ig_params['name']])
+                for ig_params in present_instance_groups if ig_params['name'] in nodes_definition
+            )
+        )
+
+        if state in ['updated', 'started']:
+            # Only instance groups created or updated are rolled (every listed one if none changed)
+            affected = [
+                ig_params['name'] for ig_params in present_instance_groups
+                if actions[ig_params['name']] in ['created', 'updated']
+            ] or [ig_params['name'] for ig_params in present_instance_groups]
+            results.update(self._apply_modifications(cluster_name, affected))
+            results['changed'] = changed or results['changed']
+
+        return results
+
+
     def check_ig_state(self, ig_name):
         """Check instance group state"""
         cluster_name = self.module.params['name']
@@ -249,7 +605,7 @@ class KopsInstanceGroup(Kops):
         if state == 'absent':
             return self.apply_absent(cluster_name, ig_name, ig_exist)
 
-        self.module.fail_json(
+        self.module_fail_json(
             msg="Operation not supported",
             cluster_name=cluster_name,
             ig_name=ig_name
@@ -259,9 +615,12 @@ class KopsInstanceGroup(Kops):
 
     def exit_json(self):
         """Send back result to Ansible"""
-        results = self.check_ig_state(self.module.params['ig_name'])
+        if self.module.params['instance_groups'] is not None:
+            results = self.check_instance_groups_state(self.module.params['instance_groups'])
+        else:
+            results = self.check_ig_state(self.module.params['ig_name'])
 
-        self.module.exit_json(**results)
+        self.module_exit_json(spec_changes=self.spec_changes, **results)
 
 
 def main():